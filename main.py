@@ -9,8 +9,32 @@ import numpy as np
 from pandas import Timedelta
 from tqdm import tqdm
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import os
 
+_mdp = None
+_weights = None
+
+def _init_simulation_worker(mdp, weights):
+    """ Gives each simulation process its own copy of the decision process """
+    global _mdp, _weights
+    _mdp, _weights = mdp, weights
+
+def _simulate(seed):
+    """ Runs one seeded simulation, the path is padded with the final state to the length of the horizon
+
+    Returns
+        path, wave timeline and daily cases of the run, sent back as each worker simulates its own copy of the process
+    """
+    np.random.seed(seed)
+    _mdp.init()
+    _mdp.reset()
+    _mdp.run(_weights)
+    while len(_mdp.path) <= _mdp.horizon: # Ensure all paths are equal length
+        _mdp.path.append(_mdp.state)
+    wave_timeline = _mdp.wave_timeline if _mdp.use_wave_factor else None
+    return _mdp.path, wave_timeline, _mdp.epidemic_function.daily_cases
+
 if __name__ == '__main__':
     # Set initial parameters
     runs = 500
@@ -31,8 +55,8 @@ if __name__ == '__main__':
     np.random.seed(42)
 
     # Read data and generate parameters
-    paths = utils.create_named_tuple('paths', 'filepaths.txt')
-    config = utils.create_named_tuple('config', paths.config)
+    paths = utils.create_namespace('filepaths.txt')
+    config = utils.create_namespace(paths.config)
     age_labels = utils.generate_labels_from_bins(config.age_bins)
     population = utils.generate_custom_population(config.age_bins, age_labels)
     contact_matrices = utils.generate_contact_matrices(config.age_bins, age_labels, population)
@@ -53,6 +77,7 @@ if __name__ == '__main__':
     plot_results = False
     plot_geo = False
     write_simulations_to_file = True
+    processes = None # number of processes running simulations, None gives one per cpu
 
     vaccine_policy = Policy(
                     config=config,
@@ -106,7 +131,8 @@ if __name__ == '__main__':
                 random_individuals=params["random_individuals"],
                 expected_years_remaining=expected_years_remaining,
                 verbose=True,
-                individuals_from_file=params["individuals_from_file"])
+                individuals_from_file=params["individuals_from_file"],
+                processes=processes)
         GA.run()
     else:
         weighted = policies[policy_number] == 'weighted'
@@ -120,17 +146,17 @@ if __name__ == '__main__':
         results = []
         run_paths = []
         seeds = np.arange(runs)
-        for i in tqdm(range(runs)):
-            np.random.seed(seeds[i])
-            mdp.init()
-            mdp.reset()
-            mdp.run(weights)
-            results.append(mdp.state)
-            while len(mdp.path) <= horizon: # Ensure all paths are equal length
-                mdp.path.append(mdp.state)
-            run_paths.append(mdp.path)
-            utils.print_results(mdp.state, population, age_labels, vaccine_policy)
-            print("\n",mdp.state.trend_count,"\n")
+        # every run is seeded, so runs are independent and can be simulated in parallel
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_simulation_worker, initargs=(mdp, weights)) as executor:
+            for path, wave_timeline, daily_cases in tqdm(executor.map(_simulate, seeds), total=runs):
+                final_state = path[-1]
+                results.append(final_state)
+                run_paths.append(path)
+                last_run = path, wave_timeline, daily_cases
+                utils.print_results(final_state, population, age_labels, vaccine_policy)
+                print("\n",final_state.trend_count,"\n")
+        mdp.path, mdp.wave_timeline, epidemic_function.daily_cases = last_run # plots show the last run
+        mdp.state = mdp.path[-1]
 
         avg_results = utils.get_average_results(results, population, age_labels, vaccine_policy)
         
@@ -167,8 +193,7 @@ if __name__ == '__main__':
 
     if plot_geo:
         history, new_infections = utils.transform_path_to_numpy(mdp.path)
-        plot.plot_geospatial(paths.municipalities_geo, history, paths.municipality_plots, population, accumulated_compartment_plot=False, per_100k=False)
-        plot.create_gif(paths.municipality_gif, paths.municipality_plots)
+        plot.plot_geospatial(paths.municipalities_geo, history, paths.municipality_plots, population, accumulated_compartment_plot=False, per_100k=False, fpath_video=paths.municipality_video)
         plot.plot_commuters(population, paths.municipalities_geo, paths.municipalities_commuters)
         plot.plot_norway_map(population, paths.municipalities_geo)
         plot.plot_population()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib import rcParams
 import pandas as pd
 import utils
 import seaborn as sns
@@ -9,14 +10,19 @@ from matplotlib import dates as mdates
 from scipy.interpolate import interp1d
 from matplotlib import ticker
 from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from tqdm import tqdm
 import imageio
-from os import listdir
-import re
+from PIL import Image
+from os import scandir
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 #import contextily as ctx
 #import geopandas as gpd
 #from shapely.geometry import Point, LineString
 
+# compartments in the order they are stored in the simulation history
 color_scheme = {
     "S": '#0000ff',
     "E1": '#fbff03',
@@ -38,10 +44,10 @@ def age_group_infected_plot_weekly(res, start_date, labels, R_eff=None, include_
     """
     fig, ax1 = plt.subplots(figsize=(10,5))
     fig.suptitle('Weekly infected in each age group')
-    lines = []
-    for i, label in enumerate(labels):
-        lines.append(ax1.plot(res[:, 1, i], label=label)[0])
-    lines.append(ax1.plot(res.sum(axis=2)[:,1], color='r', linestyle='dashed', label="All")[0])
+    lines = ax1.plot(res[:, 1, :len(labels)])
+    for line, label in zip(lines, labels):
+        line.set_label(label)
+    lines.append(ax1.plot(res[:,1].sum(axis=1), color='r', linestyle='dashed', label="All")[0])
     ax1.set_xlabel('Week')
     ax1.set_ylabel('Infected')
     if include_R:
@@ -49,10 +55,7 @@ def age_group_infected_plot_weekly(res, start_date, labels, R_eff=None, include_
         lines.append(ax2.plot(R_eff[:len(res)], color='k', linestyle='dashdot', label="Wave factor")[0])
         ax2.set_ylabel('Wave factor')
 
-    ticks = min(len(res), 20)
-    step = int(np.ceil(len(res)/ticks))
-    weeknumbers = [(start_date + timedelta(i*7)).isocalendar()[1] for i in range(len(res))]
-    plt.xticks(np.arange(0, len(res), step), weeknumbers[::step])
+    plt.xticks(*_week_ticks(start_date, len(res), max_ticks=20))
     labels = [ln.get_label() for ln in lines]
     plt.legend(lines, labels)
     plt.grid()
@@ -68,81 +71,47 @@ def age_group_infected_plot_weekly_cumulative(res, start_date, labels):
     """
     fig = plt.figure(figsize=(10,5))
     fig.suptitle('Weekly cumulative infected in each age group')
-    for i, label in enumerate(labels):
-        plt.plot(np.cumsum(res[:, i]), label=label) 
-    plt.plot(np.cumsum(res.sum(axis=1)), color='r', linestyle='dashed', label="All")
-    ticks = min(len(res), 20)
-    step = int(np.ceil(len(res)/ticks))
-    weeknumbers = [(start_date + timedelta(i*7)).isocalendar()[1] for i in range(len(res))]
-    plt.xticks(np.arange(0, len(res), step), weeknumbers[::step])
+    cumulative = np.cumsum(res, axis=0) # all age groups in one pass
+    for line, label in zip(plt.plot(cumulative[:, :len(labels)]), labels):
+        line.set_label(label)
+    plt.plot(cumulative.sum(axis=1), color='r', linestyle='dashed', label="All")
+    plt.xticks(*_week_ticks(start_date, len(res), max_ticks=20))
     plt.ylabel("Infected (cumulative)")
     plt.xlabel("Week")
     plt.legend()
     plt.grid()
     plt.show()
 
-def age_group_infected_plot_weekly_cumulative(res, start_date, labels):
-    """ plots cumulative infection for different age groups per week
-    
-    Parameters
-        res: numpy array with shape (decision_period*horizon, #compartments)
-        start_date: datetime object giving start date
-        labels: labels for plotted age_groups 
+def _week_ticks(start_date, n_weeks, max_ticks):
+    """ finds evenly spaced x-ticks for weekly data, only the week numbers of the drawn ticks are computed
+
+    Args:
+        start_date (datetime): date of the first week
+        n_weeks (int): number of weeks plotted
+        max_ticks (int): maximum number of ticks
+    Returns:
+        numpy.ndarray, list: tick positions and their week numbers
     """
-    fig = plt.figure(figsize=(10,5))
-    fig.suptitle('Weekly cumulative infected in each age group')
-    for i, label in enumerate(labels):
-        plt.plot(np.cumsum(res[:, i]), label=label) 
-    plt.plot(np.cumsum(res.sum(axis=1)), color='r', linestyle='dashed', label="All")
-    ticks = min(len(res), 20)
-    step = int(np.ceil(len(res)/ticks))
-    weeknumbers = [(start_date + timedelta(i*7)).isocalendar()[1] for i in range(len(res))]
-    plt.xticks(np.arange(0, len(res), step), weeknumbers[::step])
-    plt.ylabel("Infected (cumulative)")
-    plt.xlabel("Week")
-    plt.legend()
-    plt.grid()
-    plt.show()
+    step = int(np.ceil(n_weeks/min(n_weeks, max_ticks)))
+    positions = np.arange(0, n_weeks, step)
+    weeknumbers = [(start_date + timedelta(7*int(i))).isocalendar()[1] for i in positions]
+    return positions, weeknumbers
 
 def plot_control_measures(path, all=False):
-    new_infected = [np.sum(s.new_infected) for s in path]
-    sns.set_style('ticks')
-    if all:
-        c_weights_home = [s.contact_weights[0] for s in path]
-        c_weights_school = [s.contact_weights[1] for s in path]
-        c_weights_work = [s.contact_weights[2] for s in path]
-        c_weights_public = [s.contact_weights[3] for s in path]
-        flow_scales = [s.flow_scale for s in path]
-        weeks = [s.date.isocalendar()[1] for s in path]
-        ticks = min(len(path), 20)
-        step = int(np.ceil(len(path)/ticks))
-
-        fig, ax1 = plt.subplots(figsize=(10,5))
-        ax1.set_xlabel('Week')
-        ax1.set_ylabel('New infected')
-        ln1 = ax1.plot(new_infected, color='red', linestyle='dashed', label="New infected")
-        
-        ax2 = ax1.twinx()
-        ax2.set_ylabel('Weight')
-        ln2 = ax2.plot(c_weights_home, label="Home")
-        ln3 = ax2.plot(c_weights_school, label="School")
-        ln4 = ax2.plot(c_weights_work, label="Work")
-        ln5 = ax2.plot(c_weights_public, label="Public")
-        ln6 = ax2.plot(flow_scales, label="Internal movement")
-        
-        lines = ln1+ln2+ln3+ln4+ln5+ln6
-        labels = [ln[0].get_label() for ln in [ln1, ln2, ln3, ln4, ln5, ln6]]
-        plt.legend(lines, labels, loc=4)
-        plt.xticks(np.arange(0, len(path), step), weeks[::step])
-        plt.grid()
-        plt.savefig("plots/response_measures/response_measures_timeline_all.png", dpi=200)
-    else:
-        mean_weights = np.array([s.contact_weights for s in path]).mean(axis=1)
-        flow_scales = [s.flow_scale for s in path]
-        weeks = [s.date.isocalendar()[1] for s in path]
-        ticks = min(len(path), 20)
-        step = int(np.ceil(len(path)/ticks))
-
+    # attributes are gathered from the states in one pass, one row per state
+    n_states = len(path)
+    new_infected = np.empty(n_states)
+    contact_weights = np.empty((n_states, 4)) # home, school, work, public
+    flow_scales = np.empty(n_states)
+    for i, s in enumerate(path):
+        new_infected[i] = np.sum(s.new_infected)
+        contact_weights[i] = s.contact_weights
+        flow_scales[i] = s.flow_scale
+    ticks = min(n_states, 20)
+    step = int(np.ceil(n_states/ticks))
+    tick_positions = np.arange(0, n_states, step)
+    weeks = [path[i].date.isocalendar()[1] for i in tick_positions]
+    with sns.axes_style('ticks'): # scoped, the style of later plots is left untouched
         fig, ax1 = plt.subplots(figsize=(10,5))
         ax1.set_xlabel('Week')
         ax1.set_ylabel('New infected')
@@ -150,16 +119,21 @@ def plot_control_measures(path, all=False):
 
         ax2 = ax1.twinx()
         ax2.set_ylabel('Weight')
-        ln2 = ax2.plot(mean_weights, label="Mean contact weighting")
-        ln3 = ax2.plot(flow_scales, label="Internal movement")
-        
-        lines = ln1+ln2+ln3
-        labels = [ln[0].get_label() for ln in [ln1, ln2, ln3]]
-        plt.legend(lines, labels, loc=4)
-        plt.xticks(np.arange(0, len(path), step), weeks[::step])
+        if all:
+            weight_lines = ax2.plot(contact_weights)
+            for line, label in zip(weight_lines, ["Home", "School", "Work", "Public"]):
+                line.set_label(label)
+            fpath = "plots/response_measures/response_measures_timeline_all.png"
+        else:
+            weight_lines = ax2.plot(contact_weights.mean(axis=1), label="Mean contact weighting")
+            fpath = "plots/response_measures/response_measures_timeline_mean.png"
+        lines = ln1 + weight_lines + ax2.plot(flow_scales, label="Internal movement")
+
+        plt.legend(lines, [line.get_label() for line in lines], loc=4)
+        plt.xticks(tick_positions, weeks)
         plt.grid()
-        plt.savefig("plots/response_measures/response_measures_timeline_mean.png", dpi=200)
-    plt.show()
+        plt.savefig(fpath, dpi=200)
+        plt.show()
 
 
 def plot_heatmaps(C, weights, age_labels, fpath=""):
@@ -170,24 +144,45 @@ def plot_heatmaps(C, weights, age_labels, fpath=""):
         fpath: file paths where the heat mats is saved
         weights: weights used to weight different contact matrices
     """
-    matrices = C.copy()
+    matrices = list(C)
     c_descriptions = ['Home', 'School', 'Work', 'Public', 'Combined']   
-    sns.set(font_scale=1.2)
-    sns.set_style('ticks')
     c_combined =  utils.generate_weighted_contact_matrix(C, weights)
     matrices.append(c_combined)
-    for i in range(len(matrices)):
-        plt.figure(figsize = (10,7))
-        #sns.heatmap(np.round(matrices[i],2), vmin=0, vmax=1, annot=True, cmap="Blues", xticklabels=age_labels, yticklabels=age_labels)
-        sns.heatmap(np.round(matrices[i],2), annot=True, cmap="Blues", xticklabels=age_labels, yticklabels=age_labels)
-        plt.tick_params(axis='both', which='major', labelsize=14, labelbottom=False, bottom=False, left=False, top=False, labeltop=True)
-        plt.yticks(rotation=0)
+    with sns.plotting_context('notebook', font_scale=1.2), sns.axes_style('ticks'):
         if fpath:
-            plt.savefig(fpath + c_descriptions[i], dpi=200)
+            # every matrix is saved to its own file, one figure is cleared and reused for all of them
+            fig = plt.figure(figsize = (10,7))
+            for matrix, description in zip(matrices, c_descriptions):
+                fig.clear()
+                _plot_heatmap(fig.add_subplot(), matrix, age_labels)
+                fig.savefig(fpath + description, dpi=200)
+            plt.close(fig)
         else:
-            plt.title(c_descriptions[i])
+            # shown together as panels of one figure
+            fig, axes = plt.subplots(1, len(matrices), figsize = (10*len(matrices),7), constrained_layout=True)
+            for ax, matrix, description in zip(axes, matrices, c_descriptions):
+                _plot_heatmap(ax, matrix, age_labels)
+                ax.set_title(description, pad=24) # above the age labels at the top
             plt.show()
 
+def _plot_heatmap(ax, matrix, age_labels):
+    #sns.heatmap(np.round(matrix,2), vmin=0, vmax=1, annot=True, cmap="Blues", xticklabels=age_labels, yticklabels=age_labels, ax=ax)
+    sns.heatmap(np.round(matrix,2), annot=True, cmap="Blues", xticklabels=age_labels, yticklabels=age_labels, ax=ax)
+    ax.tick_params(axis='both', which='major', labelsize=14, labelbottom=False, bottom=False, left=False, top=False, labeltop=True)
+    ax.tick_params(axis='y', labelrotation=0)
+
+@lru_cache(maxsize=None)
+def _read_region_names(fpath_region_names):
+    """ reads the region names once per file
+
+    Args:
+        fpath_region_names (str): filepath to csv with a region name on each row, in the order of the regions
+    Returns:
+        dict: index of each region name, the first region is used for names occurring more than once
+    """
+    region_names = pd.read_csv(fpath_region_names)['region_name'].drop_duplicates()
+    return dict(zip(region_names, region_names.index))
+
 def seir_plot_weekly_several_regions(res, start_date, comps_to_plot, regions, fpath_region_names):
     """plots SEIR plots for different regions
 
@@ -197,27 +192,24 @@ def seir_plot_weekly_several_regions(res, start_date, comps_to_plot, regions, fp
         comp_labels (list(str)): list of compartment labels to plot 
         regions (list(str)): list of region names of the regions to plot SEIR development
     """
-    all_comps = {"S":0, "E1":1, "E2":2, "A":3, "I":4, "R":5, "D":6, "V":7}
-    df = pd.read_csv(fpath_region_names)
-    region_indices = df[df['region_name'].isin(regions)].index.tolist()
+    all_comps = {comp: i for i, comp in enumerate(color_scheme)}
+    region_names = _read_region_names(fpath_region_names)
+    region_indices = [region_names[region] for region in regions]
     nrows = int(np.ceil(len(regions)/4))
     ncols = min(len(regions), 4)
-    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(5*ncols,5*nrows), sharex=True)
+    comp_indices = [all_comps[comp] for comp in comps_to_plot]
+    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(5*ncols,5*nrows), sharex=True, constrained_layout=True, squeeze=False)
     fig.suptitle("Weekly compartment values")
-    for i in range(len(regions)):
-        row = i // ncols
-        col = i % ncols
-        ax = axs[row][col] if nrows > 1 else axs[col]
-        ax.set_title(f'{regions[i].capitalize()}')
-        for comp in comps_to_plot:
-            ax.plot(res[:, all_comps[comp], region_indices[i]], color=color_scheme[comp], label=comp)
-        weeknumbers = [(start_date + timedelta(i*7)).isocalendar()[1] for i in range(len(res))]
+    for region, region_index, ax in zip(regions, region_indices, axs.flat):
+        ax.set_title(f'{region.capitalize()}')
+        lines = ax.plot(res[:, comp_indices, region_index])
+        for line, comp in zip(lines, comps_to_plot):
+            line.set_color(color_scheme[comp])
+            line.set_label(comp)
         ax.set_xlabel("Week")
         ax.legend()
         ax.grid()
-    ticks = min(len(res), 10)
-    step = int(np.ceil(len(res)/ticks))
-    plt.xticks(np.arange(0, len(res), step), weeknumbers[::step])
+    plt.xticks(*_week_ticks(start_date, len(res), max_ticks=10))
     plt.show()
 
 def infection_plot_weekly_several_regions(res, start_date, regions, fpath_region_names):
@@ -229,29 +221,22 @@ def infection_plot_weekly_several_regions(res, start_date, regions, fpath_region
         comp_labels (list(str)): list of compartment labels to plot 
         regions (list(str)): list of region names of the regions to plot infection for
     """
-    df = pd.read_csv(fpath_region_names)
-    region_indices = df[df['region_name'].isin(regions)].index.tolist()
+    region_names = _read_region_names(fpath_region_names)
+    region_indices = [region_names[region] for region in regions]
     nrows = int(np.ceil(len(regions)/4))
     ncols = min(len(regions), 4)
-    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(5*ncols,5*nrows), sharex=True)
+    fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(5*ncols,5*nrows), sharex=True, constrained_layout=True, squeeze=False)
     fig.suptitle("Weekly infection numbers")
-    for i in range(len(regions)):
-        row = i // ncols
-        col = i % ncols
-        ax = axs[row][col] if nrows > 1 else axs[col]
-        ax.set_title(f'{regions[i].capitalize()}')
-        ax.plot(res[:, region_indices[i]], label="New infected", color="tab:red")
-        weeknumbers = [(start_date + timedelta(i*7)).isocalendar()[1] for i in range(len(res))]
+    for region, region_index, ax in zip(regions, region_indices, axs.flat):
+        ax.set_title(f'{region.capitalize()}')
+        ax.plot(res[:, region_index], label="New infected", color="tab:red")
         ax.set_xlabel("Week")
         ax.legend(loc=2)
         ax2 = ax.twinx()
-        ax2.plot(np.cumsum(res[:, region_indices[i]]), label="Cumulative total infected", color="tab:orange")
+        ax2.plot(np.cumsum(res[:, region_index]), label="Cumulative total infected", color="tab:orange")
         ax2.legend(loc=4)
         ax.grid()
-    ticks = min(len(res), 10)
-    step = int(np.ceil(len(res)/ticks))
-    plt.xticks(np.arange(0, len(res), step), weeknumbers[::step])
-    fig.tight_layout(pad=3.0)
+    plt.xticks(*_week_ticks(start_date, len(res), max_ticks=10))
     plt.show()
         
 def find_infected_limits(res, population, per_100k):
@@ -264,10 +249,10 @@ def find_infected_limits(res, population, per_100k):
         float: max value of simulation horizon
     """
     E1_index = 1
-    max_E1_per_region = pd.DataFrame(res[:,E1_index,:], dtype = float).max()  # Finds max for E1
+    max_E1_per_region = res[:,E1_index,:].max(axis=0)  # Finds max for E1
     if not per_100k:
-            return max_E1_per_region.max() 
-    return (max_E1_per_region / (population.population/1e5)).max()
+        return max_E1_per_region.max()
+    return (max_E1_per_region / (population.population.to_numpy(dtype=np.float64)/1e5)).max()
 
 def plot_R_t(daily_cases):
     R_t = utils.get_R_t(daily_cases)
@@ -286,77 +271,121 @@ def plot_R_t(daily_cases):
     plt.grid()
     plt.show()
 
-def plot_geospatial(fpath_geospatial, res, fpath_plots, population, accumulated_compartment_plot, per_100k):
+def plot_geospatial(fpath_geospatial, res, fpath_plots, population, accumulated_compartment_plot, per_100k, processes=None, simplify_tolerance=200, fpath_video=None, fps=4):
     """plots geospatial data
     Args:
         fpath_geospatial (str): filepath to json data used to load geopandas dataframe
         res (4D array): array with compartment values. Shape: (#weeks, #compartments, #regions, #age groups)
         fpath_plots (str): filepath to directory where plots will be saved
         population (pandas.Dataframe): population for each region
+        processes (int, optional): number of processes rendering frames. Defaults to None, i.e. one per cpu
+        simplify_tolerance (float, optional): tolerance in meters when simplifying region boundaries, 0 keeps full resolution. Defaults to 200
+        fpath_video (str, optional): filepath (.mp4) the frames are encoded into instead of being saved to fpath_plots. Defaults to None
+        fps (int, optional): frames per second of the video. Defaults to 4
     """
+    import contextily as ctx
     # plot geospatial data
     gdf = utils.generate_geopandas(population, fpath_geospatial)
+    if simplify_tolerance:
+        gdf['geometry'] = gdf.geometry.simplify(simplify_tolerance, preserve_topology=True)
     res = res.sum(axis=3) # (#weeks, #compartments, #regions)
     res_accumulated_regions = res.sum(axis=2)
-    pop_factor = population.population/100000
-    
-    # extract bounds from gdf 
-    west, south, east, north = gdf.total_bounds
+    pop_factor = population.population.to_numpy(dtype=np.float64)/100000
     horizon = len(res_accumulated_regions)
 
-    # Find limits for colorbar 
+    # Find limits for colorbar and compartment plot
     v_max = find_infected_limits(res, population, per_100k)
+    inset_y_max = 5500000 if accumulated_compartment_plot else res_accumulated_regions[:, 1].max() * 1.1
+
+    # fetch background tiles once, every frame reuses the same image
+    west, south, east, north = gdf.total_bounds
+    basemap = ctx.bounds2img(west, south, east, north, zoom='auto', source=ctx.providers.Stamen.TonerLite)
+
+    # only the plotted data is sent to the rendering processes
+    ix_data = 4 # S, E1, E2, A, I, R, D, V
+    data_to_plot = res[:, ix_data, :] / pop_factor if per_100k else res[:, ix_data, :]
+    renderer_args = (gdf, basemap, data_to_plot, res_accumulated_regions, v_max, inset_y_max, accumulated_compartment_plot, fpath_plots)
+
+    # make the plots, either saved as jpgs or encoded straight into a video without going through disk
+    if processes == 1:
+        renderer = _GeospatialFrameRenderer(*renderer_args)
+        frames = map(renderer.draw if fpath_video else renderer.render, range(horizon))
+        _output_frames(tqdm(frames, total=horizon), fpath_video, fps)
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_frame_renderer, initargs=renderer_args) as executor:
+            frames = executor.map(_draw_frame if fpath_video else _render_frame, range(horizon))
+            _output_frames(tqdm(frames, total=horizon), fpath_video, fps)
+
+def _output_frames(frames, fpath_video, fps):
+    """ Encodes drawn frames into a video, or only runs through the frames when they are saved by the renderer """
+    if fpath_video:
+        _write_video(fpath_video, frames, fps)
+    else:
+        for _ in frames:
+            pass
+
+class _GeospatialFrameRenderer:
+    def __init__(self, gdf, basemap, data_to_plot, res_accumulated_regions, v_max, inset_y_max, accumulated_compartment_plot, fpath_plots):
+        """ Builds the geospatial figure once, frames are rendered by updating the data of its artists
+
+        Args:
+            gdf (geopandas.GeoDataFrame): geometry for each region
+            basemap (numpy.ndarray, tuple): background image and its extent, as returned by contextily.bounds2img
+            data_to_plot (numpy.ndarray): values to color regions by. Shape: (#weeks, #regions)
+            res_accumulated_regions (numpy.ndarray): compartment values accumulated over regions. Shape: (#weeks, #compartments)
+            v_max (float): upper limit of colorbar
+            inset_y_max (float): upper limit of compartment plot
+            accumulated_compartment_plot (bool): True if all compartments are plotted in the compartment plot
+            fpath_plots (str): filepath to directory where plots will be saved
+        """
+        self.data_to_plot = data_to_plot
+        self.fpath_plots = fpath_plots
+        west, south, east, north = gdf.total_bounds
+        horizon = len(res_accumulated_regions)
 
-    # make the plots 
-    for time_step in tqdm(range(horizon)):
- 
-        # Plot geospatial data
-        ix_data = 4 # S, E1, E2, A, I, R, D, V
-        data_to_plot = res[time_step, ix_data,:] * pop_factor if per_100k else res[time_step, ix_data,:]
-        fig, ax = plt.subplots(figsize=(14,14), dpi=72)
-        # import pdb;pdb.set_trace()
+        # the figure is not registered with pyplot, it is drawn directly by the Agg canvas
+        self.fig = Figure(figsize=(14,14), dpi=72)
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot()
         gdf.plot(ax=ax, facecolor='none', edgecolor='gray', alpha=0.5, linewidth=0.5, zorder=2)
-        gdf.plot(ax=ax, column=data_to_plot, cmap='Reds', zorder=3,  legend=True, vmin=0, vmax=v_max, legend_kwds={'shrink': 0.95})
+
+        # multipolygons are drawn as one patch per polygon, map each patch to its region
+        gdf_parts = gdf.reset_index(drop=True).explode(index_parts=False)
+        self.part_to_region = gdf_parts.index.to_numpy()
+        gdf_parts.plot(ax=ax, column=np.zeros(len(gdf_parts)), cmap='Reds', zorder=3, vmin=0, vmax=v_max)
+        self.choropleth = ax.collections[-1]
+        self.fig.colorbar(self.choropleth, ax=ax, shrink=0.95) # the choropleth itself is the mappable of the colorbar
         
         # add background
-        ctx.add_basemap(ax, zoom='auto', crs=3857, source=ctx.providers.Stamen.TonerLite, alpha=0.6, attribution="")
+        basemap_img, basemap_extent = basemap
+        ax.imshow(basemap_img, extent=basemap_extent, interpolation='bilinear', alpha=0.6)
         ax.set_axis_off()
         ax.set_xlim(west, east)
         ax.set_ylim(south, north)
         ax.axis('off')
         
         # axes for compartment plot 
-        inset_ax = fig.add_axes([0.4, 0.16, 0.37, 0.27]) # l:left, b:bottom, w:width, h:height
+        inset_ax = self.fig.add_axes([0.4, 0.16, 0.37, 0.27]) # l:left, b:bottom, w:width, h:height
         inset_ax.patch.set_alpha(0.5)
-
         if accumulated_compartment_plot:
-            # lines
-            inset_ax.plot(res_accumulated_regions[:time_step, 0], label="S",  color=color_scheme['S'],  ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 1], label="E1", color=color_scheme['E1'], ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 2], label="E2", color=color_scheme['E2'], ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 3], label="A",  color=color_scheme['A'],  ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 4], label="I",  color=color_scheme['I'],  ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 5], label="R",  color=color_scheme['R'],  ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 6], label="D",  color=color_scheme['D'],  ls='-', lw=1.5, alpha=0.8)
-            inset_ax.plot(res_accumulated_regions[:time_step, 7], label="V",  color=color_scheme['V'],  ls='-', lw=1.5, alpha=0.8)
-            # circles on lines
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 0], color=color_scheme['S'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 1], color=color_scheme['E1'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 2], color=color_scheme['E2'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 3], color=color_scheme['A'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 4], color=color_scheme['I'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 5], color=color_scheme['R'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 6], color=color_scheme['D'], s=20, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 7], color=color_scheme['V'], s=20, alpha=0.8)
+            labels = list(color_scheme)
+            colours = [color_scheme[label] for label in labels]
+            self.compartment_values = res_accumulated_regions[:, :8]
         else:
-            inset_ax.plot(res_accumulated_regions[:time_step, 1], label="E1", color='red', ls='-', lw=1.5, alpha=0.8)
-            inset_ax.scatter((time_step-1), res_accumulated_regions[time_step - 1, 1], color='red', s=20, alpha=0.8)
+            labels = ['E1']
+            colours = ['red']
+            self.compartment_values = res_accumulated_regions[:, [1]]
+        self.lines = inset_ax.plot(np.empty((0, len(labels))), ls='-', lw=1.5, alpha=0.8)
+        for line, label, colour in zip(self.lines, labels, colours):
+            line.set_label(label)
+            line.set_color(colour)
+        self.circles = inset_ax.scatter(np.zeros(len(labels)), np.zeros(len(labels)), color=colours, s=20, alpha=0.8)
         
         # axes titles, label coordinates, values, font_sizes, grid, spines_colours, ticks_colours, legend, title compartment plot
         inset_ax.set_xlabel('Weeks', size=14, alpha=1, color='dimgray')
-        inset_ax.tick_params(direction='in', size=10)
+        inset_ax.tick_params(direction='in', size=10, labelsize=14)
         inset_ax.set_xlim(-1, horizon)
-        inset_ax.set_ylim(-1, 5500000) if accumulated_compartment_plot else inset_ax.set_ylim(-1, res_accumulated_regions[:, 1].max() * 1.1) 
+        inset_ax.set_ylim(-1, inset_y_max)
         if accumulated_compartment_plot:
             inset_ax.yaxis.set_major_formatter(lambda x, pos: '{0:g} M'.format(x/1e6))
         inset_ax.grid(alpha=0.4)
@@ -366,37 +395,112 @@ def plot_geospatial(fpath_geospatial, res, fpath_plots, population, accumulated_
         inset_ax.spines['bottom'].set_color('darkslategrey')
         inset_ax.tick_params(axis='x', colors='darkslategrey')
         inset_ax.tick_params(axis='y', colors='darkslategrey')
-        
-        plt.xticks(fontsize=14)
-        plt.yticks(fontsize=14)
-        plt.legend(prop={'size':14, 'weight':'light'}, framealpha=0.5)
-        plt.title("COVID-19 development in week: {}".format(time_step), fontsize=14, color='dimgray')
-        plt.draw()
-        plt.savefig(f"{fpath_plots}{time_step}.jpg", dpi=fig.dpi, bbox_inches = 'tight')
-        plt.close()
+        inset_ax.legend(prop={'size':14, 'weight':'light'}, framealpha=0.5)
+        self.title = inset_ax.set_title("", fontsize=14, color='dimgray')
+
+        # the layout is the same every frame, the tight bounding box is found with one draw here instead of every savefig
+        self.fig.canvas.draw()
+        bbox = self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(rcParams['savefig.pad_inches'])
+        x0, y0, x1, y1 = (bbox.extents * self.fig.dpi).round().astype(int)
+        height = int(self.fig.bbox.height)
+        self.crop = np.s_[height-y1:height-y0, x0:x1] # rows of the canvas buffer run from the top
 
+        # blitting, the basemap, boundaries and colorbar are drawn once into a background,
+        # every frame restores it and only draws the choropleth and the compartment plot on top
+        self.ax, self.inset_ax = ax, inset_ax
+        self.choropleth.set_animated(True)
+        inset_ax.set_animated(True)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
 
-def create_gif(fpath_gif, fpath_plots):
+    def draw(self, time_step):
+        """ Draws the frame of a given week
+
+        Args:
+            time_step (int): week to plot
+        Returns:
+            numpy.ndarray: RGB image of the frame
+        """
+        self.choropleth.set_array(self.data_to_plot[time_step][self.part_to_region])
+        weeks = np.arange(time_step)
+        for i, line in enumerate(self.lines):
+            line.set_data(weeks, self.compartment_values[:time_step, i])
+        self.circles.set_offsets(np.column_stack((np.full(len(self.lines), time_step-1), self.compartment_values[time_step-1])))
+        self.title.set_text("COVID-19 development in week: {}".format(time_step))
+        self.fig.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.choropleth)
+        self.fig.draw_artist(self.inset_ax)
+        return np.asarray(self.fig.canvas.buffer_rgba())[self.crop][..., :3].copy()
+
+    def render(self, time_step):
+        """ Saves the frame of a given week
+
+        Args:
+            time_step (int): week to plot
+        """
+        # frames are only read back to make the gif or video, a baseline jpeg decodes to the same pixels as a progressive one
+        # and is several times faster to encode
+        Image.fromarray(self.draw(time_step)).save(f"{self.fpath_plots}{time_step:05d}.jpg", quality=80, optimize=False)
+
+_frame_renderer = None
+
+def _init_frame_renderer(*renderer_args):
+    """ Builds one figure per rendering process """
+    global _frame_renderer
+    _frame_renderer = _GeospatialFrameRenderer(*renderer_args)
+
+def _render_frame(time_step):
+    _frame_renderer.render(time_step)
+
+def _draw_frame(time_step):
+    return _frame_renderer.draw(time_step)
+
+
+def create_gif(fpath_gif, fpath_plots, fps=4):
     """generates a gif
     Args:
         fpath_gif (str): filepath (.gif) indicating where gif will be stored
         fpath_plots (str): filepath to directory where plots is stored
+        fps (int, optional): frames per second. Defaults to 4
     """
-    def sort_in_order( l ):
-        convert = lambda text: int(text) if text.isdigit() else text
-        alphanumeric_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
-        return sorted(l, key=alphanumeric_key)
-    filenames = listdir(fpath_plots)
-    filenames = sort_in_order(filenames)
-    with imageio.get_writer(fpath_gif, mode='I', fps=4) as writer:
-        for filename in tqdm(filenames):
-            image = imageio.imread(fpath_plots + '{}'.format(filename))
-            writer.append_data(image)
+    # every frame is mapped to one shared palette, taken from the last frame where all lines are drawn,
+    # so frames are quantized by a lookup and only the regions changing between frames are written
+    palette = Image.open(_frame_paths(fpath_plots)[-1]).quantize(256)
+    frames = (Image.fromarray(image).quantize(palette=palette, dither=Image.NONE) for image in _read_frames(fpath_plots))
+    first_frame = next(frames)
+    first_frame.save(fpath_gif, save_all=True, append_images=frames, duration=1000/fps, loop=0)
+
+def create_video(fpath_video, fpath_plots, fps=4):
+    """generates a video, encoded by ffmpeg (much smaller and faster to write than a gif)
+    Args:
+        fpath_video (str): filepath (.mp4) indicating where video will be stored
+        fpath_plots (str): filepath to directory where plots is stored
+        fps (int, optional): frames per second. Defaults to 4
+    """
+    _write_video(fpath_video, _read_frames(fpath_plots), fps)
+
+def _write_video(fpath_video, frames, fps):
+    # frames are padded with white to multiples of 16 pixels, the macro block size of the encoder, so they are not rescaled
+    with imageio.get_writer(fpath_video, format='FFMPEG', fps=fps, codec='libx264', quality=8) as writer:
+        for image in frames:
+            height, width = image.shape[:2]
+            writer.append_data(np.pad(image, ((0, -height % 16), (0, -width % 16), (0, 0)), constant_values=255))
+
+def _frame_paths(fpath_plots):
+    """ paths of the frames in a plot directory in the order they were plotted, frame names are zero-padded time steps """
+    with scandir(fpath_plots) as entries:
+        return sorted(entry.path for entry in entries if entry.name.endswith('.jpg'))
+
+def _read_frames(fpath_plots):
+    """ yields the frames of a plot directory in the order they were plotted """
+    for frame_path in tqdm(_frame_paths(fpath_plots)):
+        yield imageio.imread(frame_path)
 
 def plot_commuters(population, fpath_muncipalities_geo, fpath_commuters):
     """ generate plot of all commuter connections between municipalities
     """
-    pd.options.mode.chained_assignment = None  # default='warn'
+    import geopandas as gpd
+    import shapely
     # load and clean geospatial data
     gdf = utils.generate_geopandas(population, fpath_muncipalities_geo)
     gdf['center'] = gdf.centroid
@@ -416,18 +520,13 @@ def plot_commuters(population, fpath_muncipalities_geo, fpath_commuters):
     df2 = df2[['from', 'to', 'n', 'from_geo', 'center']]
     df2 = df2.rename(columns={'center': 'to_geo'})
     
-    # generate linestrings
-    df2['line'] = None
-    l = []
-    for index, row in df2.iterrows():
-        if df2['to_geo'][index].is_empty or  df2['from_geo'][index].is_empty :
-            l.append(False)
-        else:
-            l.append(True)
-    df2 = df2[l]
-    for index, row in df2.iterrows():
-        df2['line'][index] = LineString([df2['from_geo'][index], df2['to_geo'][index]])
-    gdf2 = gpd.GeoDataFrame(df2, geometry=df2['line'])
+    # generate linestrings, connections to regions without geometry are dropped
+    from_geo = gpd.GeoSeries(df2['from_geo'], crs=gdf.crs)
+    to_geo = gpd.GeoSeries(df2['to_geo'], crs=gdf.crs)
+    connected = ~(from_geo.isna() | to_geo.isna() | from_geo.is_empty | to_geo.is_empty)
+    from_geo, to_geo = from_geo[connected], to_geo[connected]
+    endpoints = np.stack([np.column_stack([from_geo.x, from_geo.y]), np.column_stack([to_geo.x, to_geo.y])], axis=1)
+    gdf2 = gpd.GeoDataFrame(df2[connected], geometry=shapely.linestrings(endpoints), crs=gdf.crs)
 
     # plot
     fig, ax1 = plt.subplots(figsize=(20, 20))
@@ -441,14 +540,15 @@ def plot_commuters(population, fpath_muncipalities_geo, fpath_commuters):
 def plot_population():
     """ Generate demographics histogram for different age groups
     """
-    df = pd.read_csv('data/age_groups/age_divided_population.csv')
-    df = df[['age', 'population']]
-    df = df.groupby('age').sum().reset_index()
+    df = pd.read_csv('data/age_groups/age_divided_population.csv', usecols=['age', 'population'])
     plt.style.use('seaborn')
     csfont = {'fontname':'Times New Roman'}
-    bins = [0, 18, 45, 55, 65, 75, 85, 100]
+    bins = np.array([0, 18, 45, 55, 65, 75, 85, 100])
+    # ages are whole years below 100, the population of every row is added to its age group directly
+    age_groups = np.searchsorted(bins, df.age.to_numpy(), side='right') - 1
+    age_group_population = np.bincount(age_groups, weights=df.population.to_numpy(), minlength=len(bins)-1)
     _, ax = plt.subplots(figsize=(18,6), dpi=80)
-    plt.hist(df.age, histtype='bar', weights=df.population, bins=bins, edgecolor='black')  
+    plt.bar(bins[:-1], age_group_population, width=np.diff(bins), align='edge', edgecolor='black')
     plt.xlabel('Age', **csfont, fontsize=16)
     plt.ylabel('Population', **csfont, fontsize=14)
     plt.xticks(**csfont, fontsize=12, ticks=bins)
@@ -2,7 +2,7 @@ import pandas as pd
 import numpy as np
 import pickle as pkl
 import ast
-from collections import namedtuple
+from types import SimpleNamespace
 import os
 from datetime import datetime, timedelta
 from pprint import pprint
@@ -23,21 +23,21 @@ class tcolors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-def create_named_tuple(name, filepath):
-    """ generate a namedtuple from a txt file
+def create_namespace(filepath):
+    """ generate a namespace from a txt file, picklable so it can be sent to spawned processes
 
     Parameters
         filepath: file path to .txt file
     Returns
-        A namedtuple representing each path needed for system execution
+        A SimpleNamespace representing each path needed for system execution
     """
     file = open(filepath, "r")
     contents = file.read()
     dictionary = ast.literal_eval(contents)
     file.close()
-    return namedtuple(name, dictionary.keys())(**dictionary)
+    return SimpleNamespace(**dictionary)
 
-paths = create_named_tuple('paths', 'filepaths.txt')
+paths = create_namespace('filepaths.txt')
 
 def generate_commuter_matrix(age_flow_scaling):
     """ generate an OD-matrix used for illustrative purposes only
@@ -50,9 +50,9 @@ def generate_commuter_matrix(age_flow_scaling):
     """
     df = pd.read_csv(paths.municipalities_commuters)
     commuters = df.pivot(columns='to', index='from', values='n').fillna(0).values
-    visitors = np.array([commuters.sum(axis=0) * age_flow_scaling[a] for a in range(len(age_flow_scaling))]).T
-    visitors[np.where(visitors == 0)] = np.inf
-    age_divided_inflow = np.array([commuters.sum(axis=0) * age_flow_scaling[a] for a in range(len(age_flow_scaling))]).T
+    age_divided_inflow = np.outer(commuters.sum(axis=0), age_flow_scaling)
+    visitors = age_divided_inflow.copy()
+    visitors[visitors == 0] = np.inf
     return visitors, commuters, age_divided_inflow
 
 def write_pickle(filepath, object):
@@ -162,7 +162,7 @@ def generate_weighted_contact_matrix(C, contact_weights):
         Returns
             weighted contact matrix used in modelling
         """
-        return np.sum(np.array([np.array(C[i])*contact_weights[i] for i in range(len(C))]), axis=0)
+        return np.einsum('ijk,i->jk', np.asarray(C, dtype=np.float64), np.asarray(contact_weights, dtype=np.float64))
 
 def get_age_group_flow_scaling(bins, labels, population):
     percent_commuters = 0.36 # numbers from SSB
@@ -370,8 +370,9 @@ def get_wave_timeline(horizon, decision_period, periods_per_day, *args):
             if ws != wave_state_count[-1]:
                 wave_state_count.append(ws)
         from_start = False
+    wave_counts = Counter(wave_state_count) # number of waves of each state so far, counted as they are added
     while True:
-        n_wave = Counter(wave_state_count)[current_state]-1
+        n_wave = wave_counts[current_state]-1
         params = data['duration'][current_state][str(1 + n_wave%6)]
         duration = skewnorm.rvs(params['skew'], loc=params['mean'], scale=params['std'])
         duration = min(max(duration, params['min']), params['max']) // decision_period_days
@@ -387,7 +388,7 @@ def get_wave_timeline(horizon, decision_period, periods_per_day, *args):
             current_state = np.random.choice(['U', 'D', 'N'], p=list(transition_mat[current_state].values()))
         except:
             break
-        wave_state_count.append(current_state)
+        wave_counts[current_state] += 1
     
     return wave_timeline, wave_state_timeline
 
@@ -457,15 +458,18 @@ def generate_geopandas(pop, fpath_spatial_data):
     pop['region_id'] = pop['region_id'].astype('str')
     pop['region_id'] = pop['region_id'].apply(lambda x: '{0:0>4}'.format(x))
     pop = pop[['region_id', 'population', 'region_name']]
-    try:
-        gdf = gpd.read_file(fpath_spatial_data)
-    except:
-        gdf = gpd.read_file("../" + fpath_spatial_data)
-    gdf = gdf[['region_id', 'geometry']]
+    if not os.path.exists(fpath_spatial_data):
+        fpath_spatial_data = "../" + fpath_spatial_data
+    # reading and reprojecting the geometry is slow, the projected geometry is cached next to the json
+    fpath_projected = os.path.splitext(fpath_spatial_data)[0] + '_3857.pkl'
+    if os.path.exists(fpath_projected):
+        gdf = read_pickle(fpath_projected)
+    else:
+        gdf = gpd.read_file(fpath_spatial_data)[['region_id', 'geometry']].to_crs(3857)
+        write_pickle(fpath_projected, gdf)
     df = pd.DataFrame(gdf)
-    gdf = gpd.GeoDataFrame(df.merge(pop, right_on='region_id', left_on='region_id',  suffixes=('', '_y')), geometry='geometry')
+    gdf = gpd.GeoDataFrame(df.merge(pop, right_on='region_id', left_on='region_id',  suffixes=('', '_y')), geometry='geometry', crs=gdf.crs)
     gdf = gdf.dropna()
-    gdf = gdf.to_crs(3857)
     return gdf
 
 def sort_filenames_by_date(files):
@@ -1,20 +1,20 @@
 import numpy as np
-import scipy
+from scipy.special import stdtr
 from utils import tcolors, write_pickle, calculate_yll
-import pandas as pd
 import os
-from copy import copy
 from datetime import datetime
 from tqdm import tqdm
 from collections import defaultdict
 from functools import partial
 from datetime import datetime
 import json
-from itertools import combinations
+import csv
+from itertools import combinations, repeat
+from concurrent.futures import ProcessPoolExecutor
 
 class SimpleGeneticAlgorithm:
     def __init__(self, simulations, population_size, process, objective, min_generations, 
-                random_individuals, expected_years_remaining, verbose, individuals_from_file=None):
+                random_individuals, expected_years_remaining, verbose, individuals_from_file=None, processes=None):
         """ Initializes a simple genetic algorithm instance
 
         Args:
@@ -23,9 +23,11 @@ class SimpleGeneticAlgorithm:
             process (MarkovDecisionProcess): a process to simulate fitness of individuals
             objective (str): choice of metric to evaluate fitness
             verbose (bool): specify whether or not to print
+            processes (int, optional): number of processes simulating runs, 1 simulates in this process. Defaults to None, i.e. one per cpu
         """
         self.simulations = simulations
         self.process = process
+        self.processes = processes
         if individuals_from_file is None:
             self.population = Population(population_size, verbose, random_individuals)
             self.generation_count = 0 if individuals_from_file is None else individuals_from_file[0]
@@ -49,12 +51,21 @@ class SimpleGeneticAlgorithm:
         self._generate_output_dirs(run)
         self.verbose = verbose
 
-    def get_objective(self, objective):
-        return {"fatalities": lambda process: np.sum(process.state.D),
-                "infected": lambda process: np.sum(process.state.total_infected),
-                "weighted": lambda process: np.sum(process.state.total_infected)*0.01 + np.sum(process.state.D),
-                "yll": lambda process: calculate_yll(self.expected_years_remaining, process.state.D.sum(axis=0))
-                }[objective]
+    def get_objective_scores(self, state):
+        """ Scores a final state by every objective, the sums shared by objectives are computed once
+
+        Args:
+            state (State): final state of a simulation
+
+        Returns:
+            dict: score of the 'fatalities', 'infected', 'weighted' and 'yll' objectives
+        """
+        fatalities = state.D.sum()
+        infected = state.total_infected.sum()
+        return {"fatalities": fatalities,
+                "infected": infected,
+                "weighted": infected*0.01 + fatalities,
+                "yll": calculate_yll(self.expected_years_remaining, state.D.sum(axis=0))}
 
     def run(self):
         """ Function to evaluate current generation, create offsprings, evaluate offsprings, and generate new generations if not converged """
@@ -65,7 +76,6 @@ class SimpleGeneticAlgorithm:
             if self.check_convergence():
                 break
             self.crossover(self.generation_count)
-            self.repair_offsprings()
             self.mutation()
             self.repair_offsprings()
             self.run_population(offsprings=True)
@@ -159,10 +169,10 @@ class SimpleGeneticAlgorithm:
         pop = self.population.offsprings if offsprings else self.population.individuals
         if from_start:
             runs = self.simulations
-            seeds = [seed for seed in range(runs)]
+            seeds = range(runs)
         else:
             runs = int(self.simulations/2)
-            seeds = [np.random.randint(self.simulations, 1e+6) for _ in range(runs)]
+            seeds = np.random.randint(self.simulations, 1e+6, size=runs).tolist() # same seeds as drawing them one by one
             pop = pop[:5]
         if self.verbose: 
             if convergence_test:
@@ -171,19 +181,29 @@ class SimpleGeneticAlgorithm:
                 print(f"Finding fitness for top 5 {'offsprings' if offsprings else 'individuals'}: {pop}")
         if not from_start or self.generation_count == 0 or offsprings:
             self.reset_final_scores()
-            for run in range(runs):
-                np.random.seed(seeds[run])
-                self.process.init()
-                self.process.reset()
+            genes = [individual.genes for individual in pop]
+            if self.processes == 1:
+                runs_results = [_simulate_run(self.process, seed, genes) for seed in seeds]
+            else:
+                # every run is seeded, so runs are independent and can be simulated in parallel
+                with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_fitness_worker, initargs=(self.process,)) as executor:
+                    runs_results = list(executor.map(_simulate_run_in_worker, seeds, repeat(genes)))
+            # scores of the runs are written into one array per objective, (#individuals, #runs)
+            run_scores = defaultdict(partial(np.empty, (len(pop), len(runs_results))))
+            for run, (final_states, _) in enumerate(runs_results):
                 if self.verbose: print(f"\n{tcolors.BOLD}Finding score for run {run+1}{tcolors.ENDC}:")
-                for individual in pop:
-                    self.process.reset(reset_measures=False)
-                    self.process.run(weighted_policy_weights=individual.genes)
-                    if not convergence_test: individual.update_strategy_count(self.process.state)
-                    for obj in ['fatalities', 'infected', 'weighted', 'yll']:
-                        score = self.get_objective(obj)(self.process)
-                        self.final_scores[individual.ID][obj].append(score)
+                for i, (individual, state) in enumerate(zip(pop, final_states)):
+                    if not convergence_test: individual.update_strategy_count(state)
+                    for obj, score in self.get_objective_scores(state).items():
+                        run_scores[obj][i, run] = score
                         if self.verbose and obj == self.objective: print(f"{individual}: {score}")
+            for i, individual in enumerate(pop):
+                individual_scores = self.final_scores[individual.ID]
+                for obj, scores in run_scores.items():
+                    individual_scores[obj] = np.append(individual_scores[obj], scores[i])
+            # continue from the random state after the last run, as if the runs were simulated here
+            if runs_results:
+                np.random.set_state(runs_results[-1][1])
         if self.verbose: print(f"\n{tcolors.UNDERLINE}Mean scores:{tcolors.ENDC}")
         for individual in sorted(pop, key=lambda i: np.mean(self.final_scores[i.ID][self.objective])):
             mean_score = np.mean(self.final_scores[individual.ID][self.objective])
@@ -203,34 +223,39 @@ class SimpleGeneticAlgorithm:
         if not convergence_test: pop = self.population.sort_by_mean(pop, offsprings, from_start)
         if self.verbose: print(f"\nFinding best {'offspring' if offsprings and not convergence_test else 'individual'}...")
         range1, range2 = (1 if offsprings else 2, len(pop))
+        scores = np.array([self.final_scores[individual.ID][self.objective] for individual in pop[:range2]])
         for i in range(range1): # test two best
             first = pop[i]
-            for j in range(i+1, range2):
-                second = pop[j]
-                if not self.t_test(first, second, significance=0.25 if convergence_test else 0.5):
-                    if self.verbose: print(f"{tcolors.WARNING}Significance not fulfilled between {first} and {second}.{tcolors.ENDC}")
-                    return False
+            # the first individual is tested against all worse individuals at once
+            significant_best = self.t_test(scores[i], scores[i+1:range2], significance=0.25 if convergence_test else 0.5)
+            if not significant_best.all():
+                second = pop[i+1+np.argmin(significant_best)]
+                if self.verbose: print(f"{tcolors.WARNING}Significance not fulfilled between {first} and {second}.{tcolors.ENDC}")
+                return False
         return True
 
-    def t_test(self, first, second, significance):
+    def t_test(self, first_scores, second_scores, significance):
         """ Performs one-sided t-test to check to variables for significant difference
 
         Args:
-            first (Individual): presumed best individual
-            second (Individual): presumed worse individual
-            significance (float, optional): level of significance to test against. Defaults to 0.1.
+            first_scores (numpy.ndarray): scores of presumed best individual. Shape: (#runs)
+            second_scores (numpy.ndarray): scores of presumed worse individuals. Shape: (#individuals, #runs)
+            significance (float): level of significance to test against
 
         Returns:
-            bool: True if significance is achieved
+            numpy.ndarray: True for every worse individual where significance is achieved
         """
-        significant_best = False
-        s1 = np.array(self.final_scores[first.ID][self.objective])
-        s2 = np.array(self.final_scores[second.ID][self.objective])
-        if not (s1==s2).all():
-            z = s1 - s2
-            p = scipy.stats.ttest_ind(z, np.zeros(len(s1)), alternative="less").pvalue
-            significant_best = p < significance
-        return significant_best
+        z = first_scores - second_scores
+        n = z.shape[-1]
+        if n < 2: # no degrees of freedom
+            return np.zeros(z.shape[:-1], dtype=bool)
+        # same test as scipy.stats.ttest_ind(z, np.zeros(n), alternative="less"), with the pooled variance of z and zeros
+        # it has the statistic of a one-sample test and 2n-2 degrees of freedom
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = z.mean(axis=-1) / np.sqrt(z.var(axis=-1, ddof=1) / n)
+        p = stdtr(2*n - 2, t)
+        identical = (z == 0).all(axis=-1)
+        return ~identical & (p < significance)
 
     def crossover(self, generation_count):
         """ Creates offspring from two fittest individuals
@@ -254,63 +279,37 @@ class SimpleGeneticAlgorithm:
             p2 = parent2.genes
             if (p1 == p2).all(): continue 
             shape = p1.shape
-            o1_genes = np.zeros(shape)
-            o2_genes = np.zeros(shape)
+            rows, cols = np.indices(shape[1:])
             unique_child = False
             count = 0
             while not unique_child and count < 10: # don't make copy of parents
                 c_row = np.random.randint(0, high=shape[1])
                 c_col = np.random.randint(0, high=shape[2])
                 vertical_cross = np.random.random() < 0.5
+                # genes before the crossing point are inherited from the first parent, the rest from the second,
+                # the same for every trend state
                 if vertical_cross:
-                    o1_genes[:, :, :c_col] = p1[:, :, :c_col]
-                    o1_genes[:, :c_row, c_col] = p1[:, :c_row, c_col]
-                    o1_genes[:, c_row:, c_col] = p2[:, c_row:, c_col]
-                    o1_genes[:, :, c_col+1:] = p2[:, :, c_col+1:]
-                    o2_genes[:, :, :c_col] = p2[:, :, :c_col]
-                    o2_genes[:, :c_row, c_col] = p2[:, :c_row, c_col]
-                    o2_genes[:, c_row:, c_col] = p1[:, c_row:, c_col]
-                    o2_genes[:, :, c_col+1:] = p1[:, :, c_col+1:]
+                    from_first = (cols < c_col) | ((cols == c_col) & (rows < c_row))
                 else:
-                    o1_genes[:, :c_row, :] = p1[:, :c_row, :]
-                    o1_genes[:, c_row, :c_col] = p1[:, c_row, :c_col]
-                    o1_genes[:, c_row, c_col:] = p2[:, c_row, c_col:]
-                    o1_genes[:, c_row+1:, :] = p2[:, c_row+1:, :]
-                    o2_genes[:, :c_row, :] = p2[:, :c_row, :]
-                    o2_genes[:, c_row, :c_col] = p2[:, c_row, :c_col]
-                    o2_genes[:, c_row, c_col:] = p1[:, c_row, c_col:]
-                    o2_genes[:, c_row+1:, :] = p1[:, c_row+1:, :]
+                    from_first = (rows < c_row) | ((rows == c_row) & (cols < c_col))
+                o1_genes = np.where(from_first, p1, p2)
+                o2_genes = np.where(from_first, p2, p1)
                 unique_child = not ((p1 == o1_genes).all() or (p1 == o2_genes).all() or (p2 == o1_genes).all() or (p2 == o2_genes).all())
                 count += 1
+            # blended genes are convex combinations of normalized parents and stay normalized,
+            # only the crossed genes split weight vectors between the parents
+            blended_genes = [np.divide(p1+p2, 2), np.divide(p1+3*p2, 4), np.divide(3*p1+p2, 4)]
             if unique_child:
-                o1 = Individual(generation=generation_count, offspring=True)
-                o1.genes = o1_genes
-                o2 = Individual(generation=generation_count, offspring=True)
-                o2.genes = o2_genes
-                o3 = Individual(generation=generation_count, offspring=True)
-                o3.genes = np.divide(p1+p2, 2)
-                o4 = Individual(generation=generation_count, offspring=True)
-                o4.genes = np.divide(p1+3*p2, 4)
-                o5 = Individual(generation=generation_count, offspring=True)
-                o5.genes = np.divide(3*p1+p2, 4)
-                if new_offsprings: 
-                    self.population.offsprings = [o1,o2,o3,o4,o5]
-                    new_offsprings = False
-                else: 
-                    self.population.offsprings += [o1,o2,o3,o4,o5]
+                offspring_genes = [_normalize_genes(o1_genes), _normalize_genes(o2_genes)] + blended_genes
             else:
                 if self.verbose: print(f"{tcolors.WARNING}Unique child not found between {parent1} and {parent2}{tcolors.ENDC}")
-                o1 = Individual(generation=generation_count, offspring=True)
-                o1.genes = np.divide(p1+p2, 2)
-                o2 = Individual(generation=generation_count, offspring=True)
-                o2.genes = np.divide(p1+3*p2, 4)
-                o3 = Individual(generation=generation_count, offspring=True)
-                o3.genes = np.divide(3*p1+p2, 4)
-                if new_offsprings:
-                    self.population.offsprings = [o1,o2,o3]
-                    new_offsprings = False
-                else: 
-                    self.population.offsprings += [o1,o2,o3]
+                offspring_genes = blended_genes
+            offsprings = [Individual(generation=generation_count, offspring=True, genes=genes) for genes in offspring_genes]
+            if new_offsprings: 
+                self.population.offsprings = offsprings
+                new_offsprings = False
+            else: 
+                self.population.offsprings += offsprings
 
     def mutation(self):
         """ Randomly altering the genes of offsprings """
@@ -318,43 +317,29 @@ class SimpleGeneticAlgorithm:
             shape = offspring.genes.shape
             draw = np.random.random() 
             if draw < 0.1:
-                i1 = np.random.randint(0, high=shape[0])
-                j1 = np.random.randint(0, high=shape[1])
-                k1 = np.random.randint(0, high=shape[2])
-                i2 = np.random.randint(0, high=shape[0])
-                while i1 == i2: i2 = np.random.randint(0, high=shape[0])
-                j2 = np.random.randint(0, high=shape[1])
-                while j1 == j2: j2 = np.random.randint(0, high=shape[1])
-                k2 = np.random.randint(0, high=shape[2])
-                while k1 == k2: k2 = np.random.randint(0, high=shape[2])
-                value = copy(offspring.genes[i1, j1, k1])
-                offspring.genes[i1, j1, k1] = offspring.genes[i2, j2, k2]
-                offspring.genes[i2, j2, k2] = value
+                # a position along each axis, and a different one found by an offset of 1 to size-1 positions
+                first = np.random.randint(0, shape)
+                second = (first + np.random.randint(1, shape)) % shape
+                i1, j1, k1 = first
+                i2, j2, k2 = second
+                genes = offspring.genes
+                genes[i1, j1, k1], genes[i2, j2, k2] = genes[i2, j2, k2], genes[i1, j1, k1]
                 vertical_mutation = np.random.random() > 0.5
                 if vertical_mutation:
-                    values = copy(offspring.genes[i1, :, k1])
-                    offspring.genes[i1, :, k1] = offspring.genes[i2, :, k2]
-                    offspring.genes[i2, :, k2] = values
+                    genes[[i1, i2], :, [k1, k2]] = genes[[i2, i1], :, [k2, k1]]
                 else:
-                    values = copy(offspring.genes[i1, j1, :])
-                    offspring.genes[i1, j1, :] = offspring.genes[i2, j2, :]
-                    offspring.genes[i2, j2, :] = values
+                    genes[[i1, i2], [j1, j2], :] = genes[[i2, i1], [j2, j1], :]
+                offspring.needs_repair = True
             if draw > 0.9:
-                i = np.random.randint(0, high=shape[0])
-                j = np.random.randint(0, high=shape[1])
-                k = np.random.randint(0, high=shape[2])
-                offspring.genes[i, j, k] = int(np.random.random() > 0.5)
+                offspring.genes[tuple(np.random.randint(0, shape))] = int(np.random.random() > 0.5)
+                offspring.needs_repair = True
             
     def repair_offsprings(self):
-        """ Make sure the genes of offsprings are feasible, i.e. normalize. """
+        """ Make sure the genes of mutated offsprings are feasible, i.e. normalize. Crossover creates normalized genes. """
         for offspring in self.population.offsprings:
-            norm = np.sum(offspring.genes, axis=2, keepdims=True)
-            for loc in np.argwhere(norm==0):
-                i=loc[0]
-                j=loc[1]
-                offspring.genes[i,j,:] = np.array([1,0,0,0,0])
-                norm = np.sum(offspring.genes, axis=2, keepdims=True)
-            offspring.genes = np.divide(offspring.genes, norm)
+            if offspring.needs_repair:
+                offspring.genes = _normalize_genes(offspring.genes)
+                offspring.needs_repair = False
 
     def reset_final_scores(self, new_generation=False):
         if new_generation:
@@ -404,14 +389,13 @@ class SimpleGeneticAlgorithm:
 
     def to_pandas(self):
         """ Write summary of genetic algorithm run to csv """
-        generation = [self.generation_count for _ in range(len(self.population.individuals))]
-        ids = [individual.ID for individual in self.population.individuals]
-        mean_score = [individual.mean_score for individual in self.population.individuals]
-        gen_df = pd.DataFrame({"generation": generation, "individual": ids, "mean_score": mean_score})
-        if self.generation_count == 0 :
-            gen_df.to_csv(self.overview_path, header=True, index=False)
-        else:
-            gen_df.to_csv(self.overview_path, mode='a', header=False, index=False)
+        # the rows of a generation are appended directly, the file stays complete if a run is stopped and resumed
+        rows = [(self.generation_count, individual.ID, individual.mean_score) for individual in self.population.individuals]
+        with open(self.overview_path, 'w' if self.generation_count == 0 else 'a', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            if self.generation_count == 0:
+                writer.writerow(("generation", "individual", "mean_score"))
+            writer.writerows(rows)
 
     def __str__(self):
         out = f"Time: {datetime.now().strftime('%d.%m.%Y (%H:%M:%S)')}\n"
@@ -435,6 +419,37 @@ class SimpleGeneticAlgorithm:
         out["min_generations"] = self.min_generations
         return out
 
+_process = None
+
+def _init_fitness_worker(process):
+    """ Gives each simulation process its own copy of the decision process """
+    global _process
+    _process = process
+
+def _simulate_run_in_worker(seed, individual_genes):
+    return _simulate_run(_process, seed, individual_genes)
+
+def _simulate_run(process, seed, individual_genes):
+    """ Simulates one seeded run for a list of individuals, each individual continues from the random state of the previous
+
+    Args:
+        process (MarkovDecisionProcess): a process to simulate fitness of individuals
+        seed (int): seed of the run
+        individual_genes (list): genes of each individual
+
+    Returns:
+        list, tuple: final state of each individual and the random state at the end of the run
+    """
+    np.random.seed(seed)
+    process.init()
+    process.reset()
+    final_states = []
+    for genes in individual_genes:
+        process.reset(reset_measures=False)
+        process.run(weighted_policy_weights=genes)
+        final_states.append(process.state)
+    return final_states, np.random.get_state()
+
 class Population: 
     def __init__(self, population_size, verbose, random_individuals, individuals_from_file=None):
         """ Create population object
@@ -484,22 +499,55 @@ class Population:
                 self.individuals[:5] = sorted(pop[:5], key=lambda x: x.mean_score)
                 return self.individuals[:5]
 
+def _normalize_genes(genes):
+    """ Normalizes each weight vector of the genes, weight vectors that are all zero are replaced by the default weights
+
+    Args:
+        genes (numpy.ndarray): shape #trend_states, #times_per_state, #number of weights
+
+    Returns:
+        numpy.ndarray: normalized genes
+    """
+    default_weights = np.array([1,0,0,0,0])
+    norm = np.sum(genes, axis=2, keepdims=True)
+    genes = np.where(norm == 0, default_weights, genes)
+    return np.divide(genes, np.sum(genes, axis=2, keepdims=True))
+
+def _create_gene_templates():
+    """ Deterministic genes of individual 0-16, each a weight vector repeated for every trend state and occurrence
+
+    Returns:
+        list: genes of shape #trend_states, #times_per_state, #number of weights
+    """
+    weights = list(np.eye(5)) # one policy
+    for size in range(2, 5): # all pairs, triples and the four of policies 1-4
+        for comb in combinations(np.arange(4)+1, size):
+            weight = np.zeros(5)
+            weight[list(comb)] = 1/size
+            weights.append(weight)
+    weights.append(np.full(5, 1/5)) # all policies
+    return [np.tile(weight, (3,3,1)) for weight in weights]
+
+_GENE_TEMPLATES = _create_gene_templates()
+
 class Individual:
     ID_COUNTER=1
     GENERATION=0
 
-    def __init__(self, i=-1, generation=0, offspring=False):
+    def __init__(self, i=-1, generation=0, offspring=False, genes=None):
         """ Create individual instance
 
         Args:
             i (int, optional): what number of individual it is, to determine genes. Defaults to -1.
             generation (int, optional): what generation the individual belongs to. Defaults to 0.
             offspring (bool, optional): True if the individual is an offspring. Defaults to False.
+            genes (numpy.ndarray, optional): genes of the individual, e.g. inherited from parents. Defaults to None, i.e. created from i.
         """
         self.ID = self.get_id(generation, offspring)
         self.mean_score = 0
         self.genetype = i
-        self.genes = self.create_genes(i)
+        self.genes = self.create_genes(i) if genes is None else genes
+        self.needs_repair = False
         self.strategy_count = defaultdict(partial(defaultdict, int))
     
     def get_id(self, generation, offspring):
@@ -529,25 +577,10 @@ class Individual:
         Returns:
             numpy.ndarray: shape #trend_states, #times_per_state, #number of weights
         """
+        if 0 <= i < len(_GENE_TEMPLATES):
+            return _GENE_TEMPLATES[i].copy()
         genes = np.zeros((3,3,5))
-        if 0 <= i < 5:
-            genes[:,:,i] = 1
-        elif 5 <= i < 11:
-            comb = list(combinations(np.arange(4)+1, 2))
-            genes[:, :, comb[i-5][0]] = 1/2
-            genes[:, :, comb[i-5][1]] = 1/2
-        elif 11 <= i < 15:
-            comb = list(combinations(np.arange(4)+1, 3))
-            genes[:, :, comb[i-11][0]] = 1/3
-            genes[:, :, comb[i-11][1]] = 1/3
-            genes[:, :, comb[i-11][2]] = 1/3
-        elif i==15:
-            for j in range(1,5):
-                genes[:, :, j] = 1/4
-        elif i==16:
-            for j in range(5):
-                genes[:, :, j] = 1/5
-        elif i==17: # Set one weight vector randomly, make for each timestep
+        if i==17: # Set one weight vector randomly, make for each timestep
             weights = np.zeros(5)
             for j in range(5):
                 high = 100 if j > 0 else 50
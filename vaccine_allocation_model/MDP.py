@@ -5,6 +5,9 @@ from datetime import timedelta
 from utils import get_wave_timeline, tcolors
 from copy import copy, deepcopy
 
+# change of each contact weight per level of its response measure, home, school and work have levels 0-3, public 0-4
+CONTACT_WEIGHT_EFFECTS = {'home': 0.07, 'school': -0.27, 'work': -0.25, 'public': -0.20}
+
 class MarkovDecisionProcess:
     def __init__(self, config, decision_period, population, epidemic_function, 
                 initial_state, response_measure_model, use_response_measures, 
@@ -12,7 +15,7 @@ class MarkovDecisionProcess:
         """ A Markov decision process adminestering states, decisions and exogeneous information for an epidemic
 
         Args:
-            config (namedtuple): case specific data
+            config (SimpleNamespace): case specific data
             decision_period (int): number of time steps between each decision
             population (pandas.DataFrame): information about population in reions and age groups
             epidemic_function (function): executable simulating the current step of the epidemic
@@ -27,6 +30,7 @@ class MarkovDecisionProcess:
         self.config = config
         self.decision_period = decision_period
         self.population = population
+        self.total_population = population.population.sum() # population is fixed, summed once for the stop criteria and per 100k features
         self.epidemic_function = epidemic_function
         self.response_measure_model = response_measure_model
         self.use_response_measures = use_response_measures
@@ -36,7 +40,14 @@ class MarkovDecisionProcess:
         self.policy = policy
         self.verbose = verbose
         self.historic_data = historic_data
+        if historic_data is not None:
+            # dates of the historic data, sorted by date, and the vaccine supply up to each date, to find the supply of
+            # a decision period by bisection
+            self.historic_dates = historic_data['date'].to_numpy()
+            self.cumulative_vaccine_supply = np.concatenate([[0], historic_data['vaccine_supply_new'].cumsum().to_numpy()])
         self.initial_state = initial_state
+        self.fhi_vaccine_plan = pd.read_csv("data/fhi_vaccine_plan.csv") # read once, every run starts from a copy
+        self.initial_contact_weights = np.array(config.initial_contact_weights)
     
     def init(self):
         self.state = deepcopy(self.initial_state)
@@ -73,7 +84,7 @@ class MarkovDecisionProcess:
         self.epidemic_function.reset(self.state.time_step//self.config.periods_per_day)
         self.path = copy(self.start_path)
         self.simulation_period = self.start_simulation_period
-        self.policy.fhi_vaccine_plan = pd.read_csv("data/fhi_vaccine_plan.csv")
+        self.policy.fhi_vaccine_plan = self.fhi_vaccine_plan.copy()
         if self.use_response_measures and reset_measures:
             self._reset_measures_timeline()
             self.measures_timeline_generated = True
@@ -98,11 +109,11 @@ class MarkovDecisionProcess:
         """
         if self.simulation_period == self.horizon:
             return True
-        if np.sum(self.state.R) / np.sum(self.population.population) > 0.7: # stop if recovered population is 70 % of total population
+        if self.state.R.sum() / self.total_population > 0.7: # stop if recovered population is 70 % of total population
             if self.verbose: print(f"{tcolors.BOLD}Reached stop-criteria in decision period {self.simulation_period}. Recovered population > 70%.{tcolors.ENDC}\n")
             return True
         
-        if np.sum([self.state.E1, self.state.E2, self.state.A, self.state.I]) < 1: # stop if infections are zero
+        if self.state.E1.sum() + self.state.E2.sum() + self.state.A.sum() + self.state.I.sum() < 1: # stop if infections are zero
             if self.verbose: print(f"{tcolors.BOLD}Reached stop-criteria in decision period {self.simulation_period}. Infected population is zero.{tcolors.ENDC}\n")
             return True
         return False
@@ -113,14 +124,12 @@ class MarkovDecisionProcess:
         Returns:
             dict: exogeneous information regarding 'vaccine_supply', 'wave_factor', 'wave_state', 'contact_weights', 'alphas' and 'flow_scale'
         """
-        today = pd.Timestamp(self.state.date)
-        end_of_decision_period = pd.Timestamp(self.state.date+timedelta(self.decision_period//self.config.periods_per_day))
-        mask = (self.historic_data['date'] > today) & (self.historic_data['date'] <= end_of_decision_period)
-        decision_period_data = self.historic_data[mask]
-        if decision_period_data.empty:
-            vaccine_supply = np.zeros(self.state.S.shape)
-        else:
-            vaccine_supply = int(decision_period_data['vaccine_supply_new'].sum()/2) # supplied vaccines need two doses, model uses only one dose
+        today = pd.Timestamp(self.state.date).to_datetime64()
+        end_of_decision_period = pd.Timestamp(self.state.date+timedelta(self.decision_period//self.config.periods_per_day)).to_datetime64()
+        # historic data after today up to and including the end of the decision period
+        # decision periods without historic data, e.g. after its last date, are supplied no vaccines
+        start, end = np.searchsorted(self.historic_dates, [today, end_of_decision_period], side='right')
+        vaccine_supply = int((self.cumulative_vaccine_supply[end] - self.cumulative_vaccine_supply[start])/2) # supplied vaccines need two doses, model uses only one dose
         information = {'vaccine_supply': vaccine_supply}
                             
         if self.use_response_measures:
@@ -165,15 +174,15 @@ class MarkovDecisionProcess:
         """
         if len(self.path) > 2:
             # Features for cases of infection
-            active_cases = np.sum(self.state.I) * 1e5/self.population.population.sum()
-            cumulative_total_cases = np.sum(self.state.total_infected) * 1e5/self.population.population.sum()
-            cases_past_week = np.sum(self.state.new_infected) * 1e5/self.population.population.sum()
-            cases_2w_ago = np.sum(self.path[-1].new_infected) * 1e5/self.population.population.sum()
+            active_cases = np.sum(self.state.I) * 1e5/self.total_population
+            cumulative_total_cases = np.sum(self.state.total_infected) * 1e5/self.total_population
+            cases_past_week = self.state.new_infected_total * 1e5/self.total_population
+            cases_2w_ago = self.path[-1].new_infected_total * 1e5/self.total_population
 
             # Features for deaths
-            cumulative_total_deaths = np.sum(self.state.D) * 1e5/self.population.population.sum()
-            deaths_past_week = np.sum(self.state.new_deaths) * 1e5/self.population.population.sum()
-            deaths_2w_ago = np.sum(self.path[-1].new_deaths) * 1e5/self.population.population.sum()
+            cumulative_total_deaths = np.sum(self.state.D) * 1e5/self.total_population
+            deaths_past_week = self.state.new_deaths_total * 1e5/self.total_population
+            deaths_2w_ago = self.path[-1].new_deaths_total * 1e5/self.total_population
 
             # Effective reproduction number feature
             R_t = self.state.R_t
@@ -181,25 +190,13 @@ class MarkovDecisionProcess:
             features = np.array([active_cases, cumulative_total_cases, cases_past_week, cases_2w_ago, 
                                 cumulative_total_deaths, deaths_past_week, deaths_2w_ago, R_t])
 
-            models, scalers = self.response_measure_model
-
             # Contact weights
-            initial_cw = np.array(self.config.initial_contact_weights)
-            cw_mapper = {
-                'home': lambda x: initial_cw[0] * (1 + x * 0.07), # x in [0, 1, 2, 3]
-                'school': lambda x: initial_cw[1] * (1 - x * 0.27), # x in [0, 1, 2, 3]
-                'work': lambda x: initial_cw[2] * (1 - x * 0.25), # x in [0, 1, 2, 3]
-                'public': lambda x: initial_cw[3] * (1 - x * 0.20) # x in [0, 1, 2, 3, 4]
-            }
-            
             new_cw = []
-            for category in ['home', 'school', 'work', 'public']:
-                input = scalers[category].transform(features.reshape(1,-1))
-                measure = models[category].predict(input)[0]
-                new_cw.append(cw_mapper[category](measure))
+            for initial_weight, (category, effect) in zip(self.initial_contact_weights, CONTACT_WEIGHT_EFFECTS.items()):
+                measure = self._predict_response_measure(category, features)
+                new_cw.append(initial_weight * (1 + measure * effect))
 
-            input = scalers['movement'].transform(features.reshape(1,-1))
-            measure = models['movement'].predict(input)[0]
+            measure = self._predict_response_measure('movement', features)
             new_flow_scale = self.config.initial_flow_scale * (1 - measure * 0.3) # measure in [0, 1, 2]
 
             if self.verbose:
@@ -220,6 +217,22 @@ class MarkovDecisionProcess:
         
         return previous_cw, previous_flow_scale
 
+    def _predict_response_measure(self, category, features):
+        """ Predicts the level of a response measure. The features are standardized with the mean and scale of the
+            fitted scaler directly, as StandardScaler.transform does, without validating the input every decision period
+
+        Args:
+            category (str): 'home', 'school', 'work', 'public' or 'movement'
+            features (numpy.ndarray): infection, death and reproduction number features
+
+        Returns:
+            int: level of the response measure
+        """
+        models, scalers = self.response_measure_model
+        scaler = scalers[category]
+        input = (features - scaler.mean_) / scaler.scale_
+        return models[category].predict(input.reshape(1,-1))[0]
+
     def _reset_measures_timeline(self):
         current_policy = self.policy.vaccine_allocation
         self.policy.vaccine_allocation = self.policy.policies['fhi_policy']
@@ -7,11 +7,12 @@ class Policy:
         """ Defining vaccine allocation pollicy
 
         Args:
-            config (namedtuple): case specific data
+            config (SimpleNamespace): case specific data
             policy (str): name of the vaccine allocation policy to be used
             population (pandas.DataFrame): information about population in reions and age groups
         """
         self.config = config
+        self.unprotected_share = 1 - config.efficacy # share of the vaccinated not protected by the vaccine
         self.policy_name = policy
         self.policies = {
             "random": self._random_policy,
@@ -25,7 +26,7 @@ class Policy:
             }
         self.vaccine_allocation = self.policies[policy]
         self.population = population
-        self.contact_matrices = contact_matrices
+        self.contact_matrices = np.asarray(contact_matrices, dtype=np.float64)
         self.age_flow_scaling = age_flow_scaling
         self.fhi_vaccine_plan = None
         self.GA = GA
@@ -45,6 +46,30 @@ class Policy:
             return self._no_vaccines()
         return self.vaccine_allocation(state, vaccines, weights)
 
+    def _get_demand(self, state):
+        """ Demand for vaccines, the susceptibles that are not vaccinated
+
+        Args:
+            state (State): current state in the simulation
+
+        Returns:
+            numpy.ndarray: a new array with the demand of each region and age group (#regions, #age_groups)
+        """
+        return state.S - self.unprotected_share * state.V
+
+    def _bound_by_demand(self, demand, vaccine_allocation):
+        """ Bounds a vaccine allocation by the demand and by zero, in place
+
+        Args:
+            demand (numpy.ndarray): demand of each region and age group
+            vaccine_allocation (numpy.ndarray): allocation of the shape of demand, overwritten by the decision
+
+        Returns:
+            numpy.ndarray: the bounded vaccine allocation
+        """
+        np.minimum(demand, vaccine_allocation, out=vaccine_allocation)
+        return np.maximum(vaccine_allocation, 0, out=vaccine_allocation)
+
     def _random_policy(self, state, M, *args):
         """ Define allocation of vaccines based on a random distribution
 
@@ -53,17 +78,30 @@ class Policy:
         """
         n_regions, n_age_groups = self.population.shape
         vaccine_allocation = np.zeros((n_regions, n_age_groups))
-        demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+        demand = self._get_demand(state)
         while M > 0:
+            # batches of 100 vaccines go to a random age group with demand, but the youngest, and then to a random region
+            # with demand in this age group. All batches are drawn at once, a batch drawn for a region without demand left
+            # is drawn again among the other regions of the age group, or among all age groups if the age group has no demand left
             possible_age_groups = np.delete(np.nonzero(demand.sum(axis=0) > 0)[0], 0)
-            age_group = np.random.choice(possible_age_groups)
-            possible_regions = np.nonzero(demand[:,age_group] > 0)[0]
-            region = np.random.choice(possible_regions)
-            allocation = np.min([M, demand[region][age_group], 100]) # consider fractional populations
-            M -= allocation
-            vaccine_allocation[region][age_group] += allocation
-            demand[region][age_group] -= allocation
-        decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+            if len(possible_age_groups) == 0:
+                break
+            batch_size = min(M, 100) # consider fractional populations
+            age_group_batches = np.random.multinomial(int(M // batch_size), np.full(len(possible_age_groups), 1/len(possible_age_groups)))
+            for age_group, batches in zip(possible_age_groups, age_group_batches):
+                age_group_demand = demand[:, age_group]
+                possible_regions = age_group_demand > 0
+                while batches > 0 and possible_regions.any():
+                    region_batches = np.random.multinomial(batches, possible_regions/possible_regions.sum())
+                    available = np.maximum(age_group_demand, 0)
+                    region_batches = np.minimum(region_batches, np.ceil(available/batch_size)) # the last batch may be partial
+                    allocation = np.minimum(region_batches * batch_size, available)
+                    batches -= int(region_batches.sum())
+                    M -= allocation.sum()
+                    vaccine_allocation[:, age_group] += allocation
+                    age_group_demand -= allocation
+                    possible_regions = age_group_demand > 0
+        decision = self._bound_by_demand(demand, vaccine_allocation)
         return decision
 
     def _no_vaccines(self, *args):
@@ -80,12 +118,12 @@ class Policy:
         Returns
             numpy.ndarray: a vaccine allocation of shape (#regions, #age_groups)
         """
-        demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+        demand = self._get_demand(state)
         demand = demand[:,1:] # remove first age group
         vaccine_allocation = np.zeros(demand.shape)
         if M > 0:
             vaccine_allocation = M * demand/np.sum(demand)
-            decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+            decision = self._bound_by_demand(demand, vaccine_allocation)
             decision = np.insert(decision, 0, 0, axis=1)
             return decision
         vaccine_allocation = np.insert(vaccine_allocation, 0, 0, axis=1)
@@ -98,16 +136,17 @@ class Policy:
             numpy.ndarray: a vaccine allocation of shape (#regions, #age_groups)
         """
         vaccine_allocation = np.zeros(self.population.shape)
-        total_infection = np.sum(state.I)
         if M > 0:
+            total_infection = np.sum(state.I)
             if total_infection > 0:
-                demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+                demand = self._get_demand(state)
                 demand = demand[:,1:] # remove first age group
                 infection_density = state.I.sum(axis=1)/total_infection
                 regional_allocation = M * infection_density
-                total_regional_demand = demand.sum(axis=1).reshape(-1,1)
-                vaccine_allocation = demand * regional_allocation.reshape(-1,1)/np.where(total_regional_demand==0, np.inf, total_regional_demand) 
-                decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+                total_regional_demand = demand.sum(axis=1)
+                # regions without demand are given no vaccines
+                vaccine_allocation = demand * regional_allocation[:,None]/np.where(total_regional_demand==0, np.inf, total_regional_demand)[:,None]
+                decision = self._bound_by_demand(demand, vaccine_allocation)
                 decision = np.insert(decision, 0, 0, axis=1)
                 return decision
         return vaccine_allocation
@@ -118,21 +157,11 @@ class Policy:
         Returns
             numpy.ndarray: a vaccine allocation of shape (#regions, #age_groups)
         """
-        demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+        demand = self._get_demand(state)
         demand = demand[:,1:] # remove first age group
         vaccine_allocation = np.zeros(demand.shape)
         if M > 0:
-            for age_group in range(demand.shape[1]-1,0,-1):
-                age_group_demand = demand[:,age_group]
-                total_age_group_demand = np.sum(age_group_demand)
-                if M < total_age_group_demand:
-                    vaccine_allocation[:,age_group] = M * age_group_demand/total_age_group_demand
-                    break
-                else:
-                    vaccine_allocation[:,age_group] = age_group_demand
-                    M -= total_age_group_demand
-                    demand[:,age_group] -= age_group_demand
-            decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+            decision = self._prioritized_decision(demand, np.arange(demand.shape[1]-1,0,-1), M)
             decision = np.insert(decision, 0, 0, axis=1)
             return decision
         vaccine_allocation = np.insert(vaccine_allocation, 0, 0, axis=1)
@@ -144,26 +173,40 @@ class Policy:
         Returns
             numpy.ndarray: a vaccine allocation of shape (#regions, #age_groups)
         """
-        demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+        demand = self._get_demand(state)
         vaccine_allocation = np.zeros(demand.shape)
         C = generate_weighted_contact_matrix(self.contact_matrices, state.contact_weights)[1:]
         contact_sum = C.sum(axis=1)
-        priority = sorted(zip(range(1,len(contact_sum)), contact_sum), key=lambda x: x[1], reverse=True)
+        priority = np.argsort(-contact_sum[:-1], kind='stable') + 1 # most contact first, ties in order of age
         if M > 0:
-            for age_group in tuple(zip(*priority))[0]:
-                age_group_demand = demand[:,age_group]
-                total_age_group_demand = np.sum(age_group_demand)
-                if M < total_age_group_demand:
-                    vaccine_allocation[:,age_group] = M * age_group_demand/total_age_group_demand
-                    break
-                else:
-                    vaccine_allocation[:,age_group] = age_group_demand
-                    M -= total_age_group_demand
-                    demand[:,age_group] -= age_group_demand
-            decision = np.minimum(demand, vaccine_allocation).clip(min=0)
-            return decision
+            return self._prioritized_decision(demand, priority, M)
         return vaccine_allocation
 
+    def _prioritized_decision(self, demand, age_groups, M):
+        """ Allocates vaccines to age groups in order of priority, each age group is given its demand until the vaccines
+            left are less than the demand of an age group, which gets these vaccines in proportion to the demand of each region
+
+        Args:
+            demand (numpy.ndarray): demand of each region and age group, the demand of age groups given their demand is used up
+            age_groups (numpy.ndarray): indices of the prioritized age groups, highest priority first
+            M (float): number of vaccines available
+
+        Returns:
+            numpy.ndarray: vaccine allocation of the shape of demand
+        """
+        vaccine_allocation = np.zeros(demand.shape)
+        age_group_demand = demand[:,age_groups]
+        total_age_group_demand = np.ascontiguousarray(age_group_demand.T).sum(axis=1)
+        # vaccines left for each age group, had every age group before it been given its demand
+        vaccines_left = np.subtract.accumulate(np.insert(total_age_group_demand, 0, M))[:-1]
+        given_demand = np.logical_and.accumulate(vaccines_left >= total_age_group_demand)
+        vaccine_allocation[:,age_groups[given_demand]] = age_group_demand[:,given_demand]
+        demand[:,age_groups[given_demand]] = 0
+        if not given_demand.all():
+            last = np.argmin(given_demand)
+            vaccine_allocation[:,age_groups[last]] = vaccines_left[last] * age_group_demand[:,last]/total_age_group_demand[last]
+        return self._bound_by_demand(demand, vaccine_allocation)
+
     def _weighted_policy(self, state, M, weights):
         """ Define allocation of vaccines based on a weighting of other policies
 
@@ -179,18 +222,18 @@ class Policy:
         weighted_policies = ["no_vaccines", "susceptible_based", "infection_based", "oldest_first", "contact_based"]
         vaccine_allocation = np.zeros(self.population.shape)
         if M > 0:
-            demand = state.S.copy() - (1-self.config.efficacy) * state.V.copy()
+            demand = self._get_demand(state)
             vaccines_per_policy = M * weights
             for i, policy in enumerate(weighted_policies):
                 vaccine_allocation += self.policies[policy](state, vaccines_per_policy[i])
-            decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+            decision = self._bound_by_demand(demand, vaccine_allocation)
             return decision
         return vaccine_allocation
 
     def _fhi_policy(self, state, M, *args):
         vaccine_allocation = np.zeros(self.population.shape)
         if M > 0:
-            demand = state.S.copy()-(1-self.config.efficacy)*state.V.copy()
+            demand = self._get_demand(state)
             if np.sum(self.fhi_vaccine_plan['n_people']) > 0:
                 while M > 0:
                     for p in range(len(self.fhi_vaccine_plan)):
@@ -206,7 +249,7 @@ class Policy:
                         M -= np.sum(allocation)
                         if M == 0: break
                     self.fhi_vaccine_plan = self.fhi_vaccine_plan[self.fhi_vaccine_plan.n_people > 0]
-                decision = np.minimum(demand, vaccine_allocation).clip(min=0)
+                decision = self._bound_by_demand(demand, vaccine_allocation)
                 return decision
         return vaccine_allocation
 
@@ -12,7 +12,7 @@ class SEAIR:
             population (pandas.DataFrame): information about population in reions and age groups
             age_group_flow_scaling (numpy.ndarray): scaling factors for commuting in each age group
             death_rates (nuumpy.ndarray): death probabilities for each age group
-            config (namedtuple): case specific data
+            config (SimpleNamespace): case specific data
             include_flow (boolean): True if simulation should include flow
             stochastic (boolean): True if commuting and contact infection should be stochastic
             use_wave_factor (boolean): True if wave factor logic should be modeled
@@ -21,9 +21,11 @@ class SEAIR:
         self.periods_per_day = config.periods_per_day
         self.time_delta = config.time_delta
         self.commuters = commuters
-        self.contact_matrices = contact_matrices
+        self.commuters_to = np.ascontiguousarray(commuters[1].T) # commuters into each region, cached for the commuting step
+        self.inverse_visitors = 1/commuters[0]
+        self.contact_matrices = np.asarray(contact_matrices, dtype=np.float64) # stacked once, weighted every simulation
         self.population = population
-        self.age_group_flow_scaling = age_group_flow_scaling
+        self.age_group_flow_scaling = np.asarray(age_group_flow_scaling, dtype=np.float64)
         self.fatality_rate_symptomatic = death_rates
         self.efficacy = config.efficacy
         self.latent_period = config.latent_period
@@ -52,10 +54,11 @@ class SEAIR:
         Returns:
             np.ndarrays: compartmental values and new infected/dead
         """
-        # Meta-parameters
-        S, E1, E2, A, I, R, D, V = state.get_compartments_values()
+        # Meta-parameters, compartments are stored as rows of one array and updated in place
+        X = np.array(state.get_compartments_values(), dtype=np.float64) # (#compartments, #regions, #age_groups)
+        S, E1, E2, A, I, R, D, V = X
         n_regions, n_age_groups = S.shape
-        age_flow_scaling = np.array(self.age_group_flow_scaling)
+        age_flow_scaling = self.age_group_flow_scaling
 
         # Get information data
         if self.use_wave_factor:
@@ -64,13 +67,12 @@ class SEAIR:
             wave_factor = self.R0 * self.periods_per_day
         C = generate_weighted_contact_matrix(self.contact_matrices, information['contact_weights'])
         C_W = self.contact_matrices[2]
-        visitors = self.commuters[0]
-        commuters = self.commuters[1] * information['flow_scale']
         age_divided_inflow = self.commuters[2] * information['flow_scale']
 
-        # Initialize variables for saving history
-        total_new_infected = np.zeros(shape=(decision_period, n_regions, n_age_groups))
-        total_new_deaths = np.zeros(shape=(decision_period, n_regions, n_age_groups))
+        # Initialize variables for accumulating new infected and dead over the decision period
+        total_new_infected = np.zeros(shape=(n_regions, n_age_groups))
+        total_new_deaths = np.zeros(shape=(n_regions, n_age_groups))
+        new_infected_today = 0
         
         # Probabilities
         r_e = self.presymptomatic_infectiousness
@@ -88,40 +90,65 @@ class SEAIR:
         # Calculate beta
         beta = wave_factor/(p*(r_e/alpha + 1/omega)+(r_a*(1-p))/gamma)
         beta_C = beta * C
-        beta_W = beta * C_W
+        # flow scale, commuters' age scaling and both beta factors are folded into the work contacts,
+        # ((f*infectious_V * a)/visitors * beta) @ (beta * C_W) == (infectious_V/visitors) @ (f * beta^2 * a[:,None] * C_W)
+        beta_W = information['flow_scale'] * beta * beta * age_flow_scaling[:, None] * C_W
+
+        # Loop invariant infectiousness of E2, A and I, transition rates and vaccines allocated per timestep
+        infectiousness = np.array([r_e, r_a, 1])
+        rate_E2 = sigma * p
+        rate_A = sigma * (1 - p)
+        rate_R_I = (1 - delta) * omega
+        rate_D = delta * omega
+        step_V = decision/decision_period
+
+        # Population of all compartments but V, every transition (and vaccination) moves individuals
+        # between these compartments, deaths included, so it is constant during the decision period
+        N = X[:7].sum(axis=0)
+
+        # Schedule of the decision period: timestep of the week, commuting periods and periods starting a new day
+        timesteps = (state.date.weekday() * self.periods_per_day + np.arange(decision_period)) % decision_period
+        period_of_day = timesteps % self.periods_per_day
+        commuting = self.include_flow & (timesteps < self.periods_per_day * 5) & (period_of_day == 2)
+        new_day = period_of_day == 0
+
+        # Transitions are written into buffers reused every timestep. All but new_E1 are a compartment times a rate,
+        # E1 -> E2, E1 -> A, E2 -> I, A -> R, I -> R and I -> D, and are computed with one broadcast multiply
+        transition_sources = [1, 1, 2, 3, 4, 4]
+        transition_rates = np.array([np.broadcast_to(rate, n_age_groups) for rate in [rate_E2, rate_A, alpha, gamma, rate_R_I, rate_D]])[:, None, :]
+        new_E1 = np.empty((n_regions, n_age_groups))
+        transitions = np.empty((6, n_regions, n_age_groups))
+        new_E2, new_A, new_I, new_R_A, new_R_I, new_D = transitions
 
         # Run simulation
-        for i in range(decision_period):
-            timestep = (state.date.weekday() * self.periods_per_day + i) % decision_period
+        for timestep, commuting_period, new_day_period in zip(timesteps.tolist(), commuting.tolist(), new_day.tolist()):
 
             # Vaccinate before flow
-            new_V = np.nan_to_num(np.minimum(S, decision/decision_period)) # in case new infected during decision period
-            unused_V = np.sum(new_V - decision/decision_period)
+            new_V = np.nan_to_num(np.minimum(S, step_V)) # in case new infected during decision period
+            unused_V = np.sum(new_V - step_V)
             state.vaccines_available += unused_V
 
             successfully_new_V = epsilon * new_V
-            S = S - successfully_new_V
-            R = R + successfully_new_V
-            V = V + new_V
+            S -= successfully_new_V
+            R += successfully_new_V
+            V += new_V
 
-            # Update population to account for new deaths
-            N = sum([S, E1, E2, A, I, R, D])
+            # Infectious pressure per individual, shared by commuting and contact transmission
+            infectious = np.tensordot(infectiousness, X[2:5], axes=1) # r_e*E2 + r_a*A + I in one pass
+            infectious /= N
 
             # Calculate new infected from commuting
             commuter_cases = 0
-            working_hours = timestep < (self.periods_per_day * 5) and timestep % self.periods_per_day == 2
-            if self.include_flow and working_hours:
+            if commuting_period:
                 # Define current transmission of infection with commuters
-                infectious_V = np.matmul(commuters.T, (r_e * E2 + r_a * A + I)/N)
-                age_divided_V = np.array([infectious_V[:,a] * age_flow_scaling[a] for a in range(len(age_flow_scaling))]).T
-                lam_j = beta * age_divided_V/visitors
-                lam_j = np.matmul(lam_j, beta_W)
+                infectious_V = np.matmul(self.commuters_to, infectious)
+                lam_j = np.matmul(infectious_V * self.inverse_visitors, beta_W)
                 commuter_cases = np.clip(S/N * age_divided_inflow * lam_j, 0, 1)
                 if self.stochastic:
                     commuter_cases = np.random.poisson(commuter_cases)
 
             # Define current transmission of infection without commuters
-            lam_i = np.matmul((r_e * E2 + r_a * A + I)/N, beta_C)
+            lam_i = np.matmul(infectious, beta_C)
             contact_cases = np.clip(S * lam_i, 0, 1)
             if self.stochastic:
                 contact_cases = np.random.poisson(contact_cases)
@@ -129,35 +156,45 @@ class SEAIR:
             #print(f"Contact cases: {np.sum(contact_cases):>6}, Commuter cases: {np.sum(commuter_cases):>6}")
 
             # Get transition values
-            new_E1  = np.clip(contact_cases + commuter_cases, None, S)
-            new_E2  = E1 * sigma * p
-            new_A   = E1 * sigma * (1 - p)
-            new_I   = E2 * alpha
-            new_R_A = A  * gamma
-            new_R_I = I  * (np.ones(len(delta)) - delta) * omega
-            new_D   = I  * delta * omega
+            np.add(contact_cases, commuter_cases, out=new_E1)
+            np.minimum(new_E1, S,   out=new_E1)
+            np.take(X, transition_sources, axis=0, out=transitions)
+            transitions *= transition_rates
 
             # Calculate values for each compartment
-            S  = S - new_E1
-            E1 = E1 + new_E1 - new_E2 - new_A
-            E2 = E2 + new_E2 - new_I
-            A  = A + new_A - new_R_A
-            I  = I + new_I - new_R_I - new_D
-            R  = R + new_R_I + new_R_A
-            D  = D + new_D
+            S  -= new_E1
+            E1 += new_E1
+            E1 -= new_E2
+            E1 -= new_A
+            E2 += new_E2
+            E2 -= new_I
+            A  += new_A
+            A  -= new_R_A
+            I  += new_I
+            I  -= new_R_I
+            I  -= new_D
+            R  += new_R_I
+            R  += new_R_A
+            D  += new_D
 
             # Save number of new infected and dead
-            total_new_infected[i] = new_I
-            total_new_deaths[i] = new_D
-
-            if timestep != 0 and timestep % self.periods_per_day == 0:
-                self.daily_cases.append(np.sum(total_new_infected[timestep-self.periods_per_day:timestep]))
+            total_new_infected += new_I
+            total_new_deaths += new_D
+
+            # New infected of the previous periods are a day's cases, the current period starts a new day
+            if new_day_period:
+                if timestep != 0:
+                    self.daily_cases.append(new_infected_today)
+                new_infected_today = 0
+            new_infected_today += new_I.sum()
         
         trend = None
         effective_reproduction_number = None
         if len(self.daily_cases) > 14:
-            R_t = get_R_t(self.daily_cases).tail(14)
+            # the last 14 estimates only depend on the last 14 + 6 days of the 7 day window and 5 days of generation time,
+            # so only these are passed on to pandas instead of the whole history
+            R_t = get_R_t(self.daily_cases[-(14 + 6 + 5):]).tail(14)
             trend = "U" if (R_t['Q0.5'] > 1).all() else "D" if (R_t['Q0.5'] < 1).all() else "N"
             effective_reproduction_number = R_t['Q0.5'].mean()
 
-        return S, E1, E2, A, I, R, D, V, total_new_infected.sum(axis=0), total_new_deaths.sum(axis=0), trend, effective_reproduction_number
\ No newline at end of file
+        return S, E1, E2, A, I, R, D, V, total_new_infected, total_new_deaths, trend, effective_reproduction_number
\ No newline at end of file
@@ -6,6 +6,11 @@ from utils import tcolors
 from copy import copy
 
 class State:
+    # a state is created every decision period, slots make creating it and reading its values cheaper
+    __slots__ = ('S', 'E1', 'E2', 'A', 'I', 'R', 'D', 'V', 'contact_weights', 'flow_scale', 'vaccines_available', 'new_infected',
+                'total_infected', 'new_deaths', 'trend', 'trend_count', 'R_t', 'date', 'time_step',
+                '_new_infected_total', '_new_deaths_total')
+
     def __init__(self, S, E1, E2, A, I, R, D, V, contact_weights, flow_scale, vaccines_available, new_infected, 
                 total_infected, new_deaths, trend, trend_count, R_t, date, time_step=0):
         """State object for the Markov Decision Process. Keeps track of relevant information for running simulations and making decisions.
@@ -50,6 +55,22 @@ class State:
         self.R_t = R_t
         self.date = date
         self.time_step = time_step
+        self._new_infected_total = None
+        self._new_deaths_total = None
+
+    @property
+    def new_infected_total(self):
+        """ Total number of new infected, summed on first use """
+        if self._new_infected_total is None:
+            self._new_infected_total = np.sum(self.new_infected)
+        return self._new_infected_total
+
+    @property
+    def new_deaths_total(self):
+        """ Total number of new deaths, summed on first use """
+        if self._new_deaths_total is None:
+            self._new_deaths_total = np.sum(self.new_deaths)
+        return self._new_deaths_total
 
     def get_transition(self, decision, information, epidemic_function, decision_period):
         """Transition fucntion for the current state in the process
@@ -101,7 +122,7 @@ class State:
                 "Infected", "Recovered", "Dead", "Vaccinated", 
                 "New infected", "Total infected"]
         values = [np.sum(compartment) for compartment in self.get_compartments_values()]
-        values.append(np.sum(self.new_infected))
+        values.append(self.new_infected_total)
         values.append(np.sum(self.total_infected))
         percent = 100 * np.array(values)/total_pop
         status = f"Date: {self.date} (week {self.date.isocalendar()[1]})\n"
@@ -118,7 +139,7 @@ class State:
                 "Infected", "Recovered", "Dead", "Vaccinated", 
                 "New infected", "Total infected"]
         values = [np.sum(compartment) for compartment in self.get_compartments_values()]
-        values.append(np.sum(self.new_infected))
+        values.append(self.new_infected_total)
         values.append(np.sum(self.total_infected))
         percent = 100 * np.array(values)/total_pop
         status = f"{tcolors.BOLD}MDP State object{tcolors.ENDC}\n"
@@ -154,13 +175,15 @@ class State:
         D  = np.zeros(pop.shape)
         V  = np.zeros(pop.shape)
 
+        # draw all infected cells at once, redraw only those exceeding the susceptibles of a cell
+        S_cells = S.reshape(-1)
+        I_cells = I.reshape(-1)
         while num_initial_infected > 0:
-            region = np.random.randint(0, pop.shape[0])
-            age_group = np.random.randint(0, pop.shape[1])
-            if S[region][age_group] > 0:
-                num_initial_infected -= 1
-                S[region][age_group] -= 1
-                I[region][age_group] += 1 
+            cells = np.random.choice(np.flatnonzero(S_cells > 0), size=num_initial_infected)
+            new_infected = np.minimum(np.bincount(cells, minlength=S_cells.size), S_cells)
+            S_cells -= new_infected
+            I_cells += new_infected
+            num_initial_infected -= int(new_infected.sum())
 
         return State(S, E1, E2, A, I, R, D, V, contact_weights, flow_scale, 0,
                     I.copy(), I.copy(), np.zeros(pop.shape), None, {"U": 0, "D": 0, "N": 0}, None, start_date, time_step)
\ No newline at end of file